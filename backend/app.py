@@ -1,9 +1,26 @@
 from flask import Flask, redirect, current_app  #Added current_app
 from flask_cors import CORS
-from config import SECRET_KEY, JWT_SECRET_KEY, DATABASE_URL, FRONTEND_PUBLIC_BASE_URL, BACKEND_PUBLIC_BASE_URL
+from config import (
+    SECRET_KEY, JWT_SECRET_KEY, DATABASE_URL, FRONTEND_PUBLIC_BASE_URL, BACKEND_PUBLIC_BASE_URL,
+    CHECKPOINT_INTERVAL, CHAIN_TAIL_SIZE, CHAIN_CACHE_SIZE,
+    BLOCKCHAIN_WRITE_BEHIND, BLOCKCHAIN_FLUSH_MAX_DELAY_MS, BLOCKCHAIN_FLUSH_BATCH_SIZE,
+    BLOCKCHAIN_DURABLE_TIMEOUT,
+    QR_CACHE_SIZE, QR_CACHE_DIR, QR_MAX_AGE, BULK_CREATE_MAX, ROLE_CACHE_TTL,
+    HISTORY_CACHE_SIZE, EVENTS_BACKEND, EVENTS_POLL_INTERVAL, EVENTS_GAP_GRACE, EVENTS_RETENTION,
+    EVENTS_HEARTBEAT, EVENTS_STREAM_MAX_AGE, PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE,
+)
 from db import db
 from flask_jwt_extended import JWTManager
-from blockchain import Blockchain
+from blockchain import Blockchain, backfill_ledger_columns
+from models import History, ProductHandler, SalesHourly, backfill_product_handlers, rebuild_sales_rollup
+from schema import upgrade_schema
+from search import ensure_search_index
+from events import make_broker
+from utils.qrcodes import QRCache
+from utils.response_cache import ResponseCache, evict_block_products
+from utils.passwords import PasswordHasher
+import click
+import json
 import os
 
 def create_app():
@@ -12,11 +29,33 @@ def create_app():
     app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
+    app.config["CHECKPOINT_INTERVAL"] = CHECKPOINT_INTERVAL
+    app.config["CHAIN_TAIL_SIZE"] = CHAIN_TAIL_SIZE
+    app.config["CHAIN_CACHE_SIZE"] = CHAIN_CACHE_SIZE
+    app.config["BLOCKCHAIN_WRITE_BEHIND"] = BLOCKCHAIN_WRITE_BEHIND
+    app.config["BLOCKCHAIN_FLUSH_MAX_DELAY_MS"] = BLOCKCHAIN_FLUSH_MAX_DELAY_MS
+    app.config["BLOCKCHAIN_FLUSH_BATCH_SIZE"] = BLOCKCHAIN_FLUSH_BATCH_SIZE
+    app.config["BLOCKCHAIN_DURABLE_TIMEOUT"] = BLOCKCHAIN_DURABLE_TIMEOUT
+    app.config["QR_MAX_AGE"] = QR_MAX_AGE
+    app.config["BULK_CREATE_MAX"] = BULK_CREATE_MAX
+    app.config["ROLE_CACHE_TTL"] = ROLE_CACHE_TTL
+    app.config["EVENTS_POLL_INTERVAL"] = EVENTS_POLL_INTERVAL
+    app.config["EVENTS_GAP_GRACE"] = EVENTS_GAP_GRACE
+    app.config["EVENTS_RETENTION"] = EVENTS_RETENTION
+    app.config["EVENTS_HEARTBEAT"] = EVENTS_HEARTBEAT
+    app.config["EVENTS_STREAM_MAX_AGE"] = EVENTS_STREAM_MAX_AGE
     if FRONTEND_PUBLIC_BASE_URL:
         app.config["FRONTEND_PUBLIC_BASE_URL"] = FRONTEND_PUBLIC_BASE_URL.rstrip("/")
     if BACKEND_PUBLIC_BASE_URL:
         app.config["BACKEND_PUBLIC_BASE_URL"] = BACKEND_PUBLIC_BASE_URL.rstrip("/")
 
+    qr_dir = QR_CACHE_DIR or os.path.join(app.instance_path, "qr_cache")
+    app.config["QR_CACHE"] = QRCache(None if qr_dir == "off" else qr_dir, max_items=QR_CACHE_SIZE)
+    app.config["HISTORY_CACHE"] = ResponseCache(max_items=HISTORY_CACHE_SIZE)
+    app.config["EVENTS"] = make_broker(app, EVENTS_BACKEND)
+    app.config["PASSWORD_HASHER"] = PasswordHasher(PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS,
+                                                   queue_depth=PASSWORD_HASH_QUEUE)
+
     CORS(app)
     db.init_app(app)
     jwt = JWTManager(app)
@@ -27,18 +66,72 @@ def create_app():
     from routes.chain_routes import bp as chain_bp
     from routes.user_routes import bp as users_bp   
     from routes.order_routes import bp as orders_bp
+    from routes.event_routes import bp as events_bp
 
     app.register_blueprint(users_bp)     
     app.register_blueprint(auth_bp)
     app.register_blueprint(products_bp)
     app.register_blueprint(chain_bp)
     app.register_blueprint(orders_bp)
+    app.register_blueprint(events_bp)
 
     # Create DB & tables if not exist, then initialize blockchain
     with app.app_context():
         db.create_all()
+        upgrade_schema(app)
+        # rows from before the product_id/type/actor columns are invisible to ledger queries
+        # until filled; idempotent and batched, so every worker can run it at startup
+        backfilled = backfill_ledger_columns()
+        if backfilled:
+            app.logger.warning(f"BLOCKCHAIN_BACKFILL: filled ledger columns for {backfilled} older blocks")
+        ensure_search_index(app)
         bc = Blockchain(app)
+        # blocks we append or pull in from other workers evict their products' cached history
+        bc.append_listeners.append(evict_block_products(app.config["HISTORY_CACHE"]))
         app.config["BLOCKCHAIN"] = bc
+        if ProductHandler.query.first() is None and History.query.first() is not None:
+            app.logger.warning("PRODUCT_HANDLERS_EMPTY: run `flask backfill-product-handlers` "
+                               "so distributors see products they handled before the upgrade")
+        if SalesHourly.query.first() is None and History.query.filter_by(status="Sold").first() is not None:
+            app.logger.warning("SALES_ROLLUP_EMPTY: run `flask rebuild-sales-rollup` "
+                               "so sales_stats includes sales recorded before the upgrade")
+
+    @app.cli.command("audit-chain")
+    @click.option("--workers", type=int, default=None, help="Process pool size (default: CPU count).")
+    @click.option("--chunk-size", type=int, default=None, help="Blocks per worker task.")
+    def audit_chain_command(workers, chunk_size):
+        """ Re-hash the whole ledger in parallel and report the first failing index. """
+        report = app.config["BLOCKCHAIN"].audit_chain(workers=workers, chunk_size=chunk_size)
+        click.echo(json.dumps(report, indent=2))
+        if not report["valid"]:
+            raise SystemExit(1)
+
+    @app.cli.command("backfill-ledger-columns")
+    @click.option("--batch-size", type=int, default=1000, help="Rows updated per transaction.")
+    def backfill_ledger_columns_command(batch_size):
+        """ Fill blocks.product_id/type/actor for blocks written before those columns existed. """
+        click.echo(f"backfilled {backfill_ledger_columns(batch_size=batch_size)} blocks")
+
+    @app.cli.command("backfill-product-handlers")
+    @click.option("--batch-size", type=int, default=5000, help="History rows read per transaction.")
+    def backfill_product_handlers_command(batch_size):
+        """ Rebuild product_handlers (who handled which product) from histories. """
+        click.echo(f"scanned {backfill_product_handlers(batch_size=batch_size)} history rows")
+
+    @app.cli.command("rebuild-sales-rollup")
+    @click.option("--batch-size", type=int, default=5000, help="Sold history rows read per batch.")
+    def rebuild_sales_rollup_command(batch_size):
+        """ Recompute the hourly sales rollup behind /api/products/sales_stats from Sold history rows. """
+        click.echo(f"rebuilt from {rebuild_sales_rollup(batch_size=batch_size)} sales")
+
+    @app.cli.command("prune-events")
+    def prune_events_command():
+        """ Delete events older than EVENTS_RETENTION seconds (database events backend). """
+        broker = app.config["EVENTS"]
+        if not hasattr(broker, "sweep"):
+            click.echo("events backend keeps nothing on disk")
+            return
+        click.echo(f"removed {broker.sweep()} events")
 
     @app.route("/")
     def home():
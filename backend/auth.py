@@ -1,15 +1,18 @@
 from flask import Blueprint, request, jsonify, current_app
-from models import User, Product, History
+from models import User, Product, History, ProductHandler, forget_sales
 from db import db
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import (
     create_access_token, jwt_required, get_jwt_identity, get_jwt
 )
-from utils.roles import role_required
+from utils.roles import role_required, invalidate_role_cache
+from utils.passwords import PasswordHasherBusy
 import datetime
 
 bp = Blueprint("auth", __name__, url_prefix="/api/auth")
 
+def _busy():
+    return jsonify({"error": "server busy hashing passwords, retry shortly"}), 503, {"Retry-After": "1"}
+
 @bp.route("/register", methods=["POST"])
 def register():
     """
@@ -25,11 +28,17 @@ def register():
 
     if User.query.filter_by(username=username).first():
         return jsonify({"error": "username already exists"}), 400
+    # give the DB connection back while the KDF runs (see login)
+    db.session.commit()
 
-    hashed = generate_password_hash(password)
+    try:
+        hashed = current_app.config["PASSWORD_HASHER"].hash(password)
+    except PasswordHasherBusy:
+        return _busy()
     user = User(username=username, password_hash=hashed, role=role)
     db.session.add(user)
     db.session.commit()
+    invalidate_role_cache()
 
     return jsonify({"message": "user registered", "user": user.to_dict()}), 201
 
@@ -45,9 +54,25 @@ def login():
     if not username or not password:
         return jsonify({"error": "username and password required"}), 400
 
+    hasher = current_app.config["PASSWORD_HASHER"]
     user = User.query.filter_by(username=username).first()
-    if not user or not check_password_hash(user.password_hash, password):
-        return jsonify({"error": "invalid credentials"}), 401
+    stored = user.password_hash if user else None
+    # give the DB connection back while the KDF runs, or a login burst holds the whole pool
+    db.session.commit()
+    try:
+        if not user or not hasher.verify(stored, password):
+            return jsonify({"error": "invalid credentials"}), 401
+    except PasswordHasherBusy:
+        return _busy()
+
+    # KDF settings changed since this hash was made: upgrade it while we have the password
+    # (skipped when the pool is full; the next login tries again)
+    if hasher.needs_rehash(stored):
+        try:
+            user.password_hash = hasher.hash(password)
+            db.session.commit()
+        except PasswordHasherBusy:
+            pass
 
     access_token = create_access_token(
         identity=str(user.id),
@@ -97,30 +122,40 @@ def delete_user(username):
 
     cascade = request.args.get("cascade", "false").lower() in ("1", "true", "yes")
 
-    deleted_products = []
-    if cascade:
-        prods = Product.query.filter_by(owner=username).all()
+    prods = Product.query.filter_by(owner=username).all() if cascade else []
+    deleted_products = [p.product_id for p in prods]
+
+    def purge():
+        if deleted_products:
+            forget_sales(deleted_products)
+            History.query.filter(History.product_id.in_(deleted_products)).delete()
+            ProductHandler.query.filter(ProductHandler.product_id.in_(deleted_products)).delete()
         for p in prods:
-            pid = p.product_id
-            History.query.filter_by(product_id=pid).delete()
             db.session.delete(p)
-            deleted_products.append(pid)
-
-    db.session.delete(user)
-    db.session.commit()
+        db.session.delete(user)
 
     bc = current_app.config.get("BLOCKCHAIN")
     if bc:
         actor = get_jwt().get("username")
-        block = bc.add_block({
-            "type": "delete_user",
-            "deleted_user": username,
-            "deleted_by": actor,
-            "cascade_deleted_products": deleted_products
-        })
-        block_info = block.to_dict()
+        try:
+            with bc.unit_of_work(durable=True) as uow:
+                # these write at once: run them under the ledger lock (see Blockchain._commit_blocks)
+                uow.defer(purge)
+                uow.stage({
+                    "type": "delete_user",
+                    "deleted_user": username,
+                    "deleted_by": actor,
+                    "cascade_deleted_products": deleted_products
+                })
+        except Exception as e:
+            current_app.logger.error(f"BLOCKCHAIN_FAILURE: {e}")
+            return jsonify({"error": "delete could not be recorded on the blockchain; nothing was deleted"}), 500
+        block_info = uow.blocks[0].to_dict()
     else:
+        purge()
+        db.session.commit()
         block_info = None
+    invalidate_role_cache()
 
     return jsonify({
         "message": f"user '{username}' deleted",
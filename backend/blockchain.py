@@ -1,21 +1,102 @@
+import atexit
+import bisect
 import hashlib
 import json
+import math
+import os
+import threading
 import time
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from models import Block as BlockModel
 from db import db
-from sqlalchemy import asc
+from sqlalchemy import and_, asc, desc, func, or_, text
+from sqlalchemy.exc import IntegrityError
+
+DEFAULT_CHECKPOINT_INTERVAL = 100
+DEFAULT_TAIL_SIZE = 1000
+DEFAULT_CACHE_SIZE = 10000
+# rows per DB round trip when streaming older blocks
+STREAM_BATCH = 1000
+# attempts to claim the next index before giving up when other workers keep winning
+APPEND_RETRIES = 10
+# pg_advisory_xact_lock key used to serialise appends on PostgreSQL
+APPEND_LOCK_KEY = 0x5C3B10C
+DEFAULT_FLUSH_MAX_DELAY_MS = 50
+DEFAULT_FLUSH_BATCH_SIZE = 256
+# longest a durability barrier waits for the flusher before giving up
+DEFAULT_DURABLE_TIMEOUT = 5.0
+
+def _hash_pair(left, right):
+    return hashlib.sha256((left + right).encode()).hexdigest()
+
+def merkle_levels(leaves):
+    """ All levels of a Merkle tree, leaves first. An odd node is carried up unchanged. """
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        prev = levels[-1]
+        level = [_hash_pair(prev[i], prev[i + 1]) for i in range(0, len(prev) - 1, 2)]
+        if len(prev) % 2:
+            level.append(prev[-1])
+        levels.append(level)
+    return levels
+
+def merkle_proof(levels, position):
+    """ Sibling path for leaf `position`: [{"hash", "side"}], side is where the sibling sits. """
+    proof = []
+    for level in levels[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append({"hash": level[sibling], "side": "left" if sibling < position else "right"})
+        position //= 2
+    return proof
+
+def verify_merkle_proof(leaf, proof, root):
+    node = leaf
+    for step in proof:
+        node = _hash_pair(step["hash"], node) if step["side"] == "left" else _hash_pair(node, step["hash"])
+    return node == root
+
+_UNSET = object()
 
 class Block:
+    """
+    Compact block: the payload is kept as its canonical JSON bytes
+    (json.dumps(data, sort_keys=True)), computed once and reused for hashing and
+    persisting. The parsed dict is only materialised when `data` is read.
+    """
+    __slots__ = ("index", "timestamp", "previous_hash", "hash", "payload", "_data")
+
     def __init__(self, index, timestamp, data, previous_hash, hash_value=None):
         self.index = index
         self.timestamp = timestamp
-        self.data = data
+        self._data = data
+        self.payload = json.dumps(data, sort_keys=True).encode()
         self.previous_hash = previous_hash
         self.hash = hash_value or self.calculate_hash()
 
+    @classmethod
+    def from_payload(cls, index, timestamp, payload, previous_hash, hash_value):
+        """ Build from a stored row without decoding the payload. """
+        block_obj = cls.__new__(cls)
+        block_obj.index = index
+        block_obj.timestamp = timestamp
+        block_obj._data = _UNSET
+        block_obj.payload = payload.encode() if isinstance(payload, str) else payload
+        block_obj.previous_hash = previous_hash
+        block_obj.hash = hash_value
+        return block_obj
+
+    @property
+    def data(self):
+        if self._data is _UNSET:
+            self._data = _decode(self.payload)
+        return self._data
+
     def calculate_hash(self):
-        block_string = f"{self.index}{self.timestamp}{json.dumps(self.data, sort_keys=True)}{self.previous_hash}"
-        return hashlib.sha256(block_string.encode()).hexdigest()
+        block_bytes = f"{self.index}{self.timestamp}".encode() + self.payload + self.previous_hash.encode()
+        return hashlib.sha256(block_bytes).hexdigest()
 
     def to_dict(self):
         return {
@@ -26,56 +107,774 @@ class Block:
             "hash": self.hash,
         }
 
+def _decode(payload):
+    try:
+        return json.loads(payload)
+    except Exception:
+        return payload.decode() if isinstance(payload, bytes) else payload
+
+# how the canonical payload spells a checkpoint's type; string values escape their quotes, so
+# only a real "type" key can contain it
+CHECKPOINT_MARKER = b'"type": "checkpoint"'
+
+def _is_checkpoint(block_obj):
+    """ Checkpoint test on the payload bytes; only blocks that carry the marker get decoded. """
+    if CHECKPOINT_MARKER not in block_obj.payload:
+        return False
+    return isinstance(block_obj.data, dict) and block_obj.data.get("type") == "checkpoint"
+
+# payload keys that name whoever caused the block, most specific first
+ACTOR_KEYS = ("actor", "by", "by_who", "updated_by", "deleted_by", "owner", "initial_custodian")
+
+def ledger_columns(data):
+    """ Values for the denormalised, indexed blocks columns (product_id, type, actor). """
+    if not isinstance(data, dict):
+        return {"product_id": None, "type": "", "actor": None}
+    actor = next((data[k] for k in ACTOR_KEYS if data.get(k)), None)
+    return {
+        "product_id": data.get("product_id") or None,
+        "type": data.get("type") or "",
+        "actor": str(actor) if actor is not None else None,
+    }
+
+def backfill_ledger_columns(batch_size=1000):
+    """
+    One-time fill of product_id/type/actor for rows written before those columns existed.
+    Rows still to do have type NULL; returns how many rows were updated.
+    """
+    done = 0
+    last_id = 0
+    while True:
+        rows = (BlockModel.query
+                .filter(BlockModel.type.is_(None), BlockModel.id > last_id)
+                .order_by(asc(BlockModel.id)).limit(batch_size).all())
+        if not rows:
+            return done
+        for r in rows:
+            for key, value in ledger_columns(_decode(r.data)).items():
+                setattr(r, key, value)
+        last_id = rows[-1].id
+        done += len(rows)
+        db.session.commit()
+
+def _audit_chunk(rows):
+    """ Process-pool worker: re-hash (index, timestamp, payload, previous_hash, hash) rows, return the first bad index. """
+    for index, timestamp, payload, previous_hash, hash_value in rows:
+        if Block.from_payload(index, timestamp, payload, previous_hash, hash_value).calculate_hash() != hash_value:
+            return index
+    return None
+
 class Blockchain:
+    """
+    Only the tip and the most recent `tail_size` blocks stay resident. Older blocks are
+    read from the `blocks` table on demand through a bounded LRU (`get_block`/`get_blocks`),
+    and whole-chain walks go through `iter_blocks`, which streams from the DB in batches.
+
+    The DB is the source of truth for the tip: several gunicorn workers each hold their own
+    Blockchain, so appends re-read the tip from the DB, rely on the unique `blocks.index`
+    to detect a lost race, and retry on top of the winner's block (see `_commit_blocks`).
+
+    With write_behind enabled, add_block and unit_of_work hash and link blocks in memory and
+    queue them; a background flusher inserts queued blocks in batches (one commit per batch). Index and
+    hash of a queued block are provisional until it is flushed: if another worker won the
+    race for those indexes, the queue is re-linked on top of the new tip. Call
+    `wait_durable()` when the caller must know its block is persisted.
+    """
     def __init__(self, app=None):
-        self.chain = []
+        self.checkpoint_interval = DEFAULT_CHECKPOINT_INTERVAL
+        self.tail_size = DEFAULT_TAIL_SIZE
+        self.cache_size = DEFAULT_CACHE_SIZE
+        self.write_behind = False
+        self.flush_max_delay = DEFAULT_FLUSH_MAX_DELAY_MS / 1000.0
+        self.flush_batch_size = DEFAULT_FLUSH_BATCH_SIZE
+        self.durable_timeout = DEFAULT_DURABLE_TIMEOUT
+        self.app = app
+        if app:
+            self.checkpoint_interval = app.config.get("CHECKPOINT_INTERVAL", DEFAULT_CHECKPOINT_INTERVAL)
+            self.tail_size = app.config.get("CHAIN_TAIL_SIZE", DEFAULT_TAIL_SIZE)
+            self.cache_size = app.config.get("CHAIN_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+            self.write_behind = app.config.get("BLOCKCHAIN_WRITE_BEHIND", False)
+            self.flush_max_delay = app.config.get("BLOCKCHAIN_FLUSH_MAX_DELAY_MS", DEFAULT_FLUSH_MAX_DELAY_MS) / 1000.0
+            self.flush_batch_size = app.config.get("BLOCKCHAIN_FLUSH_BATCH_SIZE", DEFAULT_FLUSH_BATCH_SIZE)
+            self.durable_timeout = app.config.get("BLOCKCHAIN_DURABLE_TIMEOUT", DEFAULT_DURABLE_TIMEOUT)
+        # resident recent blocks; tail[0] has index tail_start
+        self.tail = []
+        self.tail_start = 0
+        self._cache = OrderedDict()
+        # checkpoint block indexes, the block range each one seals and its Merkle root
+        self.checkpoints = []
+        self.checkpoint_starts = []
+        self.checkpoint_ends = []
+        self.checkpoint_roots = []
+        self.latest_checkpoint = None
+        self._range_trees = OrderedDict()
+        self._roots_tree = (0, None)
+        self._lock = threading.RLock()
+        # (index, hash) of the highest block already verified; normal validation only
+        # re-checks blocks appended after it. One tuple, read and replaced under _lock, so a
+        # concurrent check never pairs one run's index with another run's hash
+        self._verified = (0, None)
+        # write-behind queue of (ticket, block); tickets only grow, so "flushed up to
+        # ticket N" is a single watermark the durability barrier can wait on
+        self._cond = threading.Condition(self._lock)
+        self._pending = deque()
+        self._pending_since = None
+        self._enqueued_ticket = 0
+        self._flushed_ticket = 0
+        self._flusher = None
+        self._closing = False
+        self._flush_requested = False
+        self.flush_error = None
+        # called with every block this chain appends (ours, queued, or pulled in by refresh)
+        self.append_listeners = []
         if app:
             self.init_from_db()
 
     def init_from_db(self):
-        rows = BlockModel.query.order_by(asc(BlockModel.index)).all()
-        if not rows or rows[0].index != 0:
+        if BlockModel.query.filter_by(index=0).first() is None:
             genesis = self.create_genesis_block()
-            self.chain.append(genesis)
-            self.persist_block(genesis)
-        for r in rows:
             try:
-                data_parsed = json.loads(r.data)
-            except:
-                data_parsed = r.data
-            self.chain.append(Block(r.index, r.timestamp, data_parsed, r.previous_hash, r.hash))
+                self.persist_block(genesis)
+            except IntegrityError:
+                # another worker created it first
+                db.session.rollback()
+        last = BlockModel.query.order_by(desc(BlockModel.index)).first()
+        self.tail_start = max(0, last.index - self.tail_size + 1)
+        rows = BlockModel.query.filter(BlockModel.index >= self.tail_start).order_by(asc(BlockModel.index)).all()
+        # rows written before the type column existed are matched on the payload until backfilled
+        checkpoint_rows = (BlockModel.query
+                           .filter(BlockModel.index < self.tail_start)
+                           .filter(or_(BlockModel.type == "checkpoint",
+                                       and_(BlockModel.type.is_(None),
+                                            BlockModel.data.contains(CHECKPOINT_MARKER.decode(), autoescape=True))))
+                           .order_by(asc(BlockModel.index)).all())
+        for r in checkpoint_rows:
+            self._index_checkpoint(self._block_from_row(r))
+        for r in rows:
+            self._append(self._block_from_row(r))
+
+    @staticmethod
+    def _block_from_row(r):
+        return Block.from_payload(r.index, r.timestamp, r.data, r.previous_hash, r.hash)
+
+    def _append(self, block_obj):
+        if not self.tail:
+            self.tail_start = block_obj.index
+        self.tail.append(block_obj)
+        # trim in batches so appends stay O(1) amortised; queued blocks and the durable
+        # block under them always stay resident
+        drop = min(len(self.tail) - self.tail_size, len(self.tail) - len(self._pending) - 1)
+        if len(self.tail) > self.tail_size * 2 and drop > 0:
+            self.tail = self.tail[drop:]
+            self.tail_start += drop
+        if _is_checkpoint(block_obj):
+            self._index_checkpoint(block_obj)
+        for listener in self.append_listeners:
+            listener(block_obj)
+
+    def _index_checkpoint(self, block_obj):
+        if self.checkpoints and block_obj.index <= self.checkpoints[-1]:
+            return
+        self.checkpoints.append(block_obj.index)
+        self.checkpoint_starts.append(block_obj.data["start_index"])
+        self.checkpoint_ends.append(block_obj.data["end_index"])
+        self.checkpoint_roots.append(block_obj.data["merkle_root"])
+        self.latest_checkpoint = block_obj
+
+    def _unappend(self):
+        """ Drop the newest resident block again (only used to re-link queued blocks). """
+        block_obj = self.tail.pop()
+        if self.checkpoints and self.checkpoints[-1] == block_obj.index:
+            for seq in (self.checkpoints, self.checkpoint_starts, self.checkpoint_ends, self.checkpoint_roots):
+                seq.pop()
+            self._range_trees.pop(len(self.checkpoints), None)
+            self.latest_checkpoint = self.get_block(self.checkpoints[-1]) if self.checkpoints else None
+        return block_obj
+
+    def __len__(self):
+        return self.get_last_block().index + 1
+
+    def get_block(self, index):
+        """ Block by index: resident tail first, then the LRU, then the DB. """
+        return self.get_blocks([index])[0]
+
+    def get_blocks(self, indexes):
+        with self._lock:
+            return self._get_blocks(indexes)
+
+    def _get_blocks(self, indexes):
+        found, missing = {}, []
+        for i in indexes:
+            if self.tail_start <= i < self.tail_start + len(self.tail):
+                found[i] = self.tail[i - self.tail_start]
+            elif i in self._cache:
+                self._cache.move_to_end(i)
+                found[i] = self._cache[i]
+            else:
+                missing.append(i)
+        for n in range(0, len(missing), 500):
+            for r in BlockModel.query.filter(BlockModel.index.in_(missing[n:n + 500])).all():
+                block_obj = self._block_from_row(r)
+                found[r.index] = block_obj
+                self._cache[r.index] = block_obj
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [found.get(i) for i in indexes]
+
+    def _iter_rows(self, start=0, stop=None):
+        """ Raw (index, timestamp, data, previous_hash, hash) tuples from the DB, keyset-paged. """
+        cols = (BlockModel.index, BlockModel.timestamp, BlockModel.data, BlockModel.previous_hash, BlockModel.hash)
+        while True:
+            q = db.session.query(*cols).filter(BlockModel.index >= start)
+            if stop is not None:
+                q = q.filter(BlockModel.index < stop)
+            rows = q.order_by(asc(BlockModel.index)).limit(STREAM_BATCH).all()
+            if not rows:
+                return
+            yield from rows
+            start = rows[-1][0] + 1
+
+    def iter_blocks(self, start=0, stop=None):
+        """ Stream blocks with start <= index < stop in order without holding the whole chain. """
+        self.refresh()
+        with self._lock:
+            tail, tail_start = list(self.tail), self.tail_start
+        if stop is None:
+            stop = tail_start + len(tail)
+        if start < tail_start:
+            for r in self._iter_rows(start, min(stop, tail_start)):
+                yield Block.from_payload(*r)
+        for block_obj in tail[max(0, start - tail_start):max(0, stop - tail_start)]:
+            yield block_obj
 
     def create_genesis_block(self):
         return Block(0, time.time(), {"type": "genesis"}, "0")
 
     def get_last_block(self):
-        return self.chain[-1]
+        return self.tail[-1]
+
+    def refresh(self):
+        """ Pull blocks other workers appended since our last known index. """
+        with self._lock:
+            if self._pending:
+                # our provisional tip is ahead of the DB; the flusher reconciles on conflict
+                return 0
+            rows = (BlockModel.query
+                    .filter(BlockModel.index > self.get_last_block().index)
+                    .order_by(asc(BlockModel.index)).all())
+            for r in rows:
+                self._append(self._block_from_row(r))
+            return len(rows)
+
+    def _lock_tip(self):
+        """ Serialise tip selection inside the current transaction where the DB supports it. """
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": APPEND_LOCK_KEY})
+
+    def _commit_blocks(self, make_payloads, prepare=None):
+        """
+        Append protocol: lock (if supported), catch up with the DB tip, build the blocks on
+        top of it and insert them together with whatever the caller staged in db.session,
+        in one commit. The block insert runs in a savepoint: if another worker claimed the
+        same index (unique blocks.index), only the savepoint is rolled back and we catch up
+        and retry, so the caller's staged rows survive. `make_payloads` is called after
+        catching up and may return an empty list to skip the append. `prepare` runs first under
+        the lock, for statements that write at once (bulk deletes, upserts): issued earlier they
+        would hold the DB write lock while we wait for ours, and an appender holding ours waits
+        for theirs. The in-memory chain only advances once the commit succeeded.
+        """
+        with self._lock:
+            if self._pending and not self.wait_durable(self.durable_timeout):
+                # the flusher is stuck (see flush_error): fail this write instead of hanging it
+                raise RuntimeError(f"write-behind queue not flushed within {self.durable_timeout}s: {self.flush_error}")
+            if prepare:
+                prepare()
+            # surface errors in the caller's own rows before we start retrying
+            db.session.flush()
+            for _ in range(APPEND_RETRIES):
+                self._lock_tip()
+                self.refresh()
+                payloads = make_payloads()
+                if not payloads:
+                    return []
+                blocks, prev = [], self.get_last_block()
+                for data in payloads:
+                    prev = Block(prev.index + 1, time.time(), data, prev.hash)
+                    blocks.append(prev)
+                try:
+                    with db.session.begin_nested():
+                        db.session.add_all([self._to_model(b) for b in blocks])
+                except IntegrityError:
+                    continue
+                db.session.commit()
+                for block_obj in blocks:
+                    self._append(block_obj)
+                return blocks
+            raise RuntimeError(f"could not append block after {APPEND_RETRIES} attempts: ledger tip kept moving")
+
+    def unit_of_work(self, durable=False):
+        """
+        Stage domain rows and block payloads, commit them in one transaction:
+
+            with bc.unit_of_work() as uow:
+                db.session.add(product)
+                uow.stage({"type": "create_product", ...})
+            block = uow.blocks[0]
+
+        Statements that write straight away (Query.delete(), upserts) go in uow.defer(fn):
+        they then run under the ledger lock, never before it.
+
+        With write-behind on, the domain rows are committed first and the blocks queued for
+        the flusher (their index is provisional until flushed). durable=True then waits up to
+        durable_timeout for the flush (logged, not raised, if it does not happen).
+        """
+        return LedgerUnitOfWork(self, durable)
 
     def add_block(self, data):
-        prev = self.get_last_block()
-        new_index = prev.index + 1
-        block_obj = Block(new_index, time.time(), data, prev.hash)
-        self.chain.append(block_obj)
-        self.persist_block(block_obj)
-        return block_obj
+        if self.write_behind:
+            return self._enqueue_block(data)
+        return self.commit_blocks([data])[0]
 
-    def persist_block(self, block_obj):
-        b = BlockModel(
+    def commit_blocks(self, payloads, prepare=None):
+        """ Commit db.session together with one block per payload; returns the new blocks. """
+        blocks = self._commit_blocks(lambda: payloads, prepare)
+        try:
+            self._maybe_checkpoint()
+        except Exception as e:
+            # the caller's rows and blocks are committed; the range stays due and the next
+            # append seals it, so the caller must not see this as a failed write
+            db.session.rollback()
+            if self.app:
+                self.app.logger.error(f"BLOCKCHAIN_CHECKPOINT_FAIL: {e}")
+        return blocks
+
+    def enqueue_blocks(self, payloads):
+        """ Queue one block per payload for the flusher, at consecutive indexes; returns the blocks. """
+        with self._cond:
+            return [self._enqueue_block(data) for data in payloads]
+
+    def _enqueue_block(self, data):
+        with self._cond:
+            prev = self.get_last_block()
+            block_obj = Block(prev.index + 1, time.time(), data, prev.hash)
+            self._enqueued_ticket += 1
+            self._queue(block_obj, self._enqueued_ticket)
+            try:
+                if self._checkpoint_due():
+                    prev = self.get_last_block()
+                    self._queue(Block(prev.index + 1, time.time(), self._checkpoint_data(), prev.hash), self._enqueued_ticket)
+            except Exception as e:
+                # as in commit_blocks: the block is queued, the seal is retried on the next one
+                self.app.logger.error(f"BLOCKCHAIN_CHECKPOINT_FAIL: {e}")
+            if self._flusher is None or not self._flusher.is_alive():
+                # started lazily so it also exists in workers forked after create_app
+                self._flusher = threading.Thread(target=self._flush_loop, name="blockchain-flusher", daemon=True)
+                self._flusher.start()
+                atexit.register(self.close)
+            self._cond.notify_all()
+            return block_obj
+
+    def _queue(self, block_obj, ticket):
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        # queue first: _append's tail trimming must see this block as pending
+        self._pending.append((ticket, block_obj))
+        self._append(block_obj)
+
+    def wait_durable(self, timeout=None):
+        """
+        Durability barrier: block until everything queued so far is in the DB.
+        Returns False on timeout. A no-op when write-behind is off.
+        """
+        with self._cond:
+            target = self._enqueued_ticket
+            if self._flushed_ticket < target:
+                self._flush_requested = True
+                self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._flushed_ticket >= target, timeout)
+
+    def close(self, timeout=5):
+        """ Flush what is queued and stop the flusher. """
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join(timeout)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closing)
+                if not self._pending:
+                    return
+                # group commit: wait for a full batch, the max delay, or a barrier/close
+                deadline = self._pending_since + self.flush_max_delay
+                while len(self._pending) < self.flush_batch_size and not (self._closing or self._flush_requested):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                self._flush_requested = False
+                batch = [self._pending[i] for i in range(min(len(self._pending), self.flush_batch_size))]
+            with self.app.app_context():
+                self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        try:
+            self._lock_tip()
+            db.session.add_all([self._to_model(b) for _, b in batch])
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            with self._cond:
+                self._rebase_pending()
+            return
+        except Exception as e:
+            db.session.rollback()
+            self.flush_error = e
+            self.app.logger.error(f"BLOCKCHAIN_FLUSH_FAIL: {e}")
+            time.sleep(self.flush_max_delay or 0.05)
+            return
+        with self._cond:
+            for _ in batch:
+                self._pending.popleft()
+            self._pending_since = time.monotonic() if self._pending else None
+            self._flushed_ticket = max(self._flushed_ticket, batch[-1][0])
+            self.flush_error = None
+            self._cond.notify_all()
+
+    def _rebase_pending(self):
+        """ Another worker claimed our provisional indexes: re-link the queue on top of the DB tip. """
+        queued = list(self._pending)
+        for _ in queued:
+            self._unappend()
+        self._pending.clear()
+        self.refresh()
+        for ticket, block_obj in queued:
+            if _is_checkpoint(block_obj):
+                continue  # its range is stale; re-sealed below if still due
+            prev = self.get_last_block()
+            block_obj.index, block_obj.previous_hash = prev.index + 1, prev.hash
+            block_obj.hash = block_obj.calculate_hash()
+            self._queue(block_obj, ticket)
+            if self._checkpoint_due():
+                prev = self.get_last_block()
+                self._queue(Block(prev.index + 1, time.time(), self._checkpoint_data(), prev.hash), ticket)
+
+    def _maybe_checkpoint(self):
+        """ Seal the blocks since the previous checkpoint once `checkpoint_interval` have piled up. """
+        if not self._checkpoint_due():
+            return None
+        blocks = self._commit_blocks(self._checkpoint_payloads)
+        return blocks[0] if blocks else None
+
+    def _checkpoint_due(self):
+        start = self.checkpoints[-1] + 1 if self.checkpoints else 0
+        return self.get_last_block().index - start + 1 >= self.checkpoint_interval
+
+    def _checkpoint_payloads(self):
+        data = self._checkpoint_data()
+        return [data] if data else []
+
+    def _checkpoint_data(self):
+        # re-checked after catching up: another worker may have sealed this range already
+        if not self._checkpoint_due():
+            return None
+        start = self.checkpoints[-1] + 1 if self.checkpoints else 0
+        end = self.get_last_block().index
+        root = merkle_levels(self._hashes(start, end))[-1][0]
+        return {
+            "type": "checkpoint", "start_index": start, "end_index": end,
+            "merkle_root": root, "checkpoint_root": merkle_levels(self.checkpoint_roots + [root])[-1][0],
+            "checkpoint_count": len(self.checkpoints) + 1
+        }
+
+    def _hashes(self, start, end):
+        """ Block hashes for start..end inclusive, without decoding payloads that aren't resident. """
+        hashes = []
+        if start < self.tail_start:
+            rows = (db.session.query(BlockModel.hash)
+                    .filter(BlockModel.index >= start, BlockModel.index <= min(end, self.tail_start - 1))
+                    .order_by(asc(BlockModel.index)).all())
+            hashes = [r[0] for r in rows]
+        if end < self.tail_start:
+            # range sealed before the resident tail: a negative slice end would pull in tail hashes
+            return hashes
+        lo = max(start, self.tail_start)
+        return hashes + [b.hash for b in self.tail[lo - self.tail_start:end - self.tail_start + 1]]
+
+    def get_latest_checkpoint(self):
+        self.refresh()
+        return self.latest_checkpoint
+
+    def _range_tree(self, n):
+        """ Merkle levels for the n-th checkpoint's block range, kept in a small LRU. """
+        with self._lock:
+            return self._load_range_tree(n)
+
+    def _load_range_tree(self, n):
+        if n in self._range_trees:
+            self._range_trees.move_to_end(n)
+            return self._range_trees[n]
+        levels = merkle_levels(self._hashes(self.checkpoint_starts[n], self.checkpoint_ends[n]))
+        if levels[-1][0] != self.checkpoint_roots[n]:
+            # wrong leaves (or a tampered range): never cache it, so a fixed read is picked up next time
+            if self.app:
+                self.app.logger.error(f"MERKLE_RANGE_MISMATCH: checkpoint {self.checkpoints[n]}")
+            return levels
+        self._range_trees[n] = levels
+        if len(self._range_trees) > 64:
+            self._range_trees.popitem(last=False)
+        return levels
+
+    def get_inclusion_proof(self, block_obj):
+        """
+        Proof that `block_obj` is committed by the latest checkpoint:
+        block hash -> range merkle_root -> latest checkpoint_root.
+        Returns None for blocks not yet covered by a checkpoint.
+        """
+        latest = self.get_latest_checkpoint()
+        if latest is None or block_obj.index > latest.data["end_index"]:
+            return None
+        n = bisect.bisect_right(self.checkpoint_starts, block_obj.index) - 1
+        return {
+            "checkpoint_index": self.checkpoints[n],
+            "merkle_root": self.checkpoint_roots[n],
+            "block_proof": merkle_proof(self._range_tree(n), block_obj.index - self.checkpoint_starts[n]),
+            "checkpoint_root": latest.data["checkpoint_root"],
+            "root_proof": merkle_proof(self._checkpoint_roots_tree(), n),
+        }
+
+    def _checkpoint_roots_tree(self):
+        count, levels = self._roots_tree
+        if count != len(self.checkpoint_roots):
+            levels = merkle_levels(self.checkpoint_roots)
+            self._roots_tree = (len(self.checkpoint_roots), levels)
+        return levels
+
+    def verify_inclusion_proof(self, block_obj, proof):
+        return (block_obj.hash == block_obj.calculate_hash()
+                and verify_merkle_proof(block_obj.hash, proof["block_proof"], proof["merkle_root"])
+                and verify_merkle_proof(proof["merkle_root"], proof["root_proof"], proof["checkpoint_root"]))
+
+    def get_product_blocks(self, product_id):
+        """ Blocks recorded for one product, in chain order (indexed lookup on blocks.product_id). """
+        return list(self.query_blocks(product_id=product_id))
+
+    def product_tip(self, product_id):
+        """ Index of the newest block recorded for one product (None if it has none). """
+        with self._lock:
+            pending = [b.index for _, b in self._pending if ledger_columns(b.data)["product_id"] == product_id]
+        if pending:
+            return pending[-1]
+        return db.session.query(func.max(BlockModel.index)).filter(BlockModel.product_id == product_id).scalar()
+
+    def query_blocks(self, product_id=None, type=None, actor=None, after_index=-1, limit=None):
+        """
+        Stream blocks matching the denormalised ledger columns, filtered in SQL and
+        keyset-paged on index. Write-behind blocks not flushed yet are matched in memory.
+        """
+        self.refresh()
+        filters = {"product_id": product_id, "type": type, "actor": actor}
+        filters = {k: v for k, v in filters.items() if v is not None}
+        cols = (BlockModel.index, BlockModel.timestamp, BlockModel.data, BlockModel.previous_hash, BlockModel.hash)
+        with self._lock:
+            pending = [b for _, b in self._pending]
+        durable_tip = pending[0].index if pending else None
+        sent = 0
+        while limit is None or sent < limit:
+            q = db.session.query(*cols).filter_by(**filters).filter(BlockModel.index > after_index)
+            if durable_tip is not None:
+                q = q.filter(BlockModel.index < durable_tip)
+            batch = STREAM_BATCH if limit is None else min(STREAM_BATCH, limit - sent)
+            rows = q.order_by(asc(BlockModel.index)).limit(batch).all()
+            if not rows:
+                break
+            for r in rows:
+                yield Block.from_payload(*r)
+            sent += len(rows)
+            after_index = rows[-1][0]
+        for block_obj in pending:
+            if limit is not None and sent >= limit:
+                return
+            if block_obj.index > after_index and all(
+                    ledger_columns(block_obj.data).get(k) == v for k, v in filters.items()):
+                sent += 1
+                yield block_obj
+
+    @staticmethod
+    def _to_model(block_obj):
+        return BlockModel(
             index=block_obj.index,
             timestamp=block_obj.timestamp,
-            data=json.dumps(block_obj.data, sort_keys=True),
+            data=block_obj.payload.decode(),
             previous_hash=block_obj.previous_hash,
             hash=block_obj.hash,
+            **ledger_columns(block_obj.data),
         )
-        db.session.add(b)
+
+    def persist_block(self, block_obj):
+        db.session.add(self._to_model(block_obj))
         db.session.commit()
 
-    def is_valid_chain(self):
-        for i in range(1, len(self.chain)):
-            curr = self.chain[i]
-            prev = self.chain[i - 1]
+    def is_valid_chain(self, full=False):
+        """
+        Validate blocks appended since the last successful check.
+        full=True re-verifies the whole chain from genesis.
+        """
+        self.refresh()
+        with self._lock:
+            verified_index, verified_hash = self._verified
+        start = verified_index + 1
+        if full or verified_hash is None or verified_index > self.get_last_block().index \
+                or self.get_block(verified_index).hash != verified_hash:
+            start = 1
+        prev = self.get_block(start - 1)
+        for curr in self.iter_blocks(start):
+            error = None
             if curr.hash != curr.calculate_hash():
-                return False, f"Hash mismatch at index {curr.index}"
-            if curr.previous_hash != prev.hash:
-                return False, f"Previous hash mismatch at index {curr.index}"
-        return True, "Blockchain is valid"
\ No newline at end of file
+                error = f"Hash mismatch at index {curr.index}"
+            elif curr.previous_hash != prev.hash:
+                error = f"Previous hash mismatch at index {curr.index}"
+            if error:
+                # keep the watermark just below the bad block so later
+                # incremental checks keep failing instead of skipping it
+                self._mark_verified(prev.index, prev.hash)
+                return False, error
+            prev = curr
+        self._mark_verified(prev.index, prev.hash)
+        return True, "Blockchain is valid"
+
+    def _mark_verified(self, index, hash_value):
+        with self._lock:
+            self._verified = (index, hash_value)
+
+    def audit_chain(self, workers=None, chunk_size=None):
+        """
+        Full re-hash of the ledger spread over a process pool.
+        Rows are streamed from the DB; hashes are checked per chunk in parallel and
+        previous_hash links in one cheap pass here, so memory stays bounded by the
+        chunks in flight rather than the chain length.
+        """
+        started = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        total = len(self)
+        chunk_size = chunk_size or max(1000, math.ceil(total / (workers * 4)))
+
+        bad_hash = bad_link = None
+        last = None
+        audited = 0
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        in_flight = deque()
+
+        def collect(limit):
+            nonlocal bad_hash
+            while len(in_flight) > limit:
+                bad = in_flight.popleft().result()
+                if bad is not None and bad_hash is None:
+                    bad_hash = bad
+
+        def submit(chunk):
+            nonlocal bad_hash
+            if pool:
+                in_flight.append(pool.submit(_audit_chunk, chunk))
+                collect(workers * 2)
+            elif bad_hash is None:
+                bad_hash = _audit_chunk(chunk)
+
+        try:
+            chunk = []
+            for row in self._iter_rows(0):
+                if last is not None and row[3] != last[4]:
+                    bad_link = row[0]
+                    break
+                last = row
+                audited += 1
+                if row[0] == 0:
+                    continue
+                chunk.append(tuple(row))
+                if len(chunk) >= chunk_size:
+                    submit(chunk)
+                    chunk = []
+                    if bad_hash is not None:
+                        break
+            if chunk and bad_hash is None:
+                submit(chunk)
+            collect(0)
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+        failures = [i for i in (bad_hash, bad_link) if i is not None]
+        first_bad = min(failures) if failures else None
+        if first_bad is None:
+            self._mark_verified(last[0], last[4])
+            msg = "Blockchain is valid"
+        else:
+            prev = self.get_block(first_bad - 1)
+            self._mark_verified(prev.index, prev.hash)
+            msg = f"Hash mismatch at index {first_bad}" if first_bad == bad_hash else f"Previous hash mismatch at index {first_bad}"
+        elapsed = time.perf_counter() - started
+        return {
+            "valid": first_bad is None,
+            "message": msg,
+            "first_failing_index": first_bad,
+            "blocks": audited,
+            "workers": workers,
+            "seconds": round(elapsed, 3),
+            "blocks_per_sec": round(audited / elapsed, 1) if elapsed else None,
+        }
+
+class LedgerUnitOfWork:
+    """ See Blockchain.unit_of_work(). """
+    def __init__(self, chain, durable=False):
+        self.chain = chain
+        self.durable = durable
+        self.payloads = []
+        self.blocks = []
+        self.deferred = []
+
+    def stage(self, data):
+        self.payloads.append(data)
+
+    def defer(self, fn):
+        self.deferred.append(fn)
+
+    def _run_deferred(self):
+        for fn in self.deferred:
+            fn()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            db.session.rollback()
+            return False
+        if self.payloads and self.chain.write_behind:
+            return self._exit_write_behind()
+        try:
+            if self.payloads:
+                self.blocks = self.chain.commit_blocks(self.payloads, self._run_deferred)
+            else:
+                self._run_deferred()
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return False
+
+    def _exit_write_behind(self):
+        try:
+            # the flusher writes blocks without our session, so there is no lock to wait behind
+            self._run_deferred()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        # the rows are committed from here on; only the ledger entries are deferred
+        self.blocks = self.chain.enqueue_blocks(self.payloads)
+        if self.durable and not self.chain.wait_durable(self.chain.durable_timeout):
+            # nothing to undo any more: report it, the entries stay queued for the flusher
+            self.chain.app.logger.error(f"BLOCKCHAIN_DURABLE_TIMEOUT: {self.chain.flush_error}")
+        return False
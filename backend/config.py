@@ -7,4 +7,43 @@ SECRET_KEY = os.getenv("SECRET_KEY", "default-dev-secret")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "default-jwt-secret")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///scm.db")
 FRONTEND_PUBLIC_BASE_URL = os.getenv("FRONTEND_PUBLIC_BASE_URL")
-BACKEND_PUBLIC_BASE_URL = os.getenv("BACKEND_PUBLIC_BASE_URL")
\ No newline at end of file
+BACKEND_PUBLIC_BASE_URL = os.getenv("BACKEND_PUBLIC_BASE_URL")
+# Seal a Merkle checkpoint block every N ledger blocks
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "100"))
+# Blocks kept resident per worker, and LRU size for older blocks fetched on demand
+CHAIN_TAIL_SIZE = int(os.getenv("CHAIN_TAIL_SIZE", "1000"))
+CHAIN_CACHE_SIZE = int(os.getenv("CHAIN_CACHE_SIZE", "10000"))
+# Write-behind ledger appends: domain rows commit at once, their blocks are hashed in memory and flushed in batches
+# by a background thread (at most FLUSH_MAX_DELAY_MS late, FLUSH_BATCH_SIZE per commit)
+BLOCKCHAIN_WRITE_BEHIND = os.getenv("BLOCKCHAIN_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+BLOCKCHAIN_FLUSH_MAX_DELAY_MS = int(os.getenv("BLOCKCHAIN_FLUSH_MAX_DELAY_MS", "50"))
+BLOCKCHAIN_FLUSH_BATCH_SIZE = int(os.getenv("BLOCKCHAIN_FLUSH_BATCH_SIZE", "256"))
+# Seconds a durability barrier (deletes, or a synchronous append behind queued blocks) waits for the flusher
+BLOCKCHAIN_DURABLE_TIMEOUT = float(os.getenv("BLOCKCHAIN_DURABLE_TIMEOUT", "5"))
+# Rendered QR images: LRU entries per worker, plus a shared on-disk store (default: <instance>/qr_cache, "off" disables)
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "1024"))
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR", "")
+# Cache-Control max-age for /api/products/<id>/qrcode
+QR_MAX_AGE = int(os.getenv("QR_MAX_AGE", "86400"))
+# Largest lot accepted by POST /api/products/bulk and /api/products/update/batch
+BULK_CREATE_MAX = int(os.getenv("BULK_CREATE_MAX", "5000"))
+# Seconds a worker trusts its cached role -> usernames lists (cleared at once on register/delete in that worker)
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", "30"))
+# Cached /api/products/<id>/history responses per worker (LRU entries; 0 disables)
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "10000"))
+# Per-user event feed (/api/events): "database" fans out across workers through the events table
+# (polled every EVENTS_POLL_INTERVAL seconds); "memory" only reaches subscribers of the same process
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "database")
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1.0"))
+# seconds the poller waits for a missing event id (committed late, or rolled back) before skipping it
+EVENTS_GAP_GRACE = float(os.getenv("EVENTS_GAP_GRACE", "5"))
+# seconds events stay replayable, and the SSE keepalive / maximum stream lifetime
+EVENTS_RETENTION = int(os.getenv("EVENTS_RETENTION", "86400"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+EVENTS_STREAM_MAX_AGE = float(os.getenv("EVENTS_STREAM_MAX_AGE", "300"))
+# Password KDF as a werkzeug method string ("scrypt:<n>:<r>:<p>" or "pbkdf2:sha256:<iterations>");
+# stored hashes made with other settings are upgraded on the user's next successful login
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+# hashes computed at once per worker, and how many more may wait before login/register answer 503
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
@@ -0,0 +1,219 @@
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+from flask import current_app
+from sqlalchemy import func
+from db import db
+from models import Event
+
+# events a subscriber may fall behind by before its stream is closed (the client reconnects and replays)
+SUBSCRIBER_QUEUE = 1000
+
+class Subscription:
+    """ One open stream / long-poll for a user; the broker puts event dicts on it. """
+    def __init__(self, username, after=None):
+        self.username = username
+        # events up to this id were already seen (replayed or sent before a reconnect)
+        self.after = after or 0
+        self.closed = False
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+
+    def put(self, event):
+        if event["id"] <= self.after:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.closed = True
+
+    def get(self, timeout=None):
+        """ Next event, or None after `timeout` seconds. """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+class MemoryBroker:
+    """
+    Fan-out to the subscribers of this process only (single worker / development).
+    The most recent events are kept for Last-Event-ID replay.
+    """
+    def __init__(self, history=1000):
+        self._subs = {}
+        self._recent = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def publish(self, events):
+        """ events: iterable of (username, type, data); call after the change they describe is committed. """
+        now = time.time()
+        for username, type_, data in events:
+            with self._lock:
+                self._deliver({"id": next(self._ids), "type": type_, "data": data, "created_at": now}, username)
+
+    def _deliver(self, event, username):
+        # caller holds self._lock, so replay in subscribe() never races a live delivery
+        self._last_id = event["id"]
+        self._recent.append((username, event))
+        for sub in self._subs.get(username, ()):
+            sub.put(event)
+
+    def last_event_id(self):
+        return self._last_id
+
+    def _replay(self, username, after):
+        return [e for u, e in self._recent if u == username and e["id"] > after]
+
+    def subscribe(self, username, after=None):
+        """ Start receiving `username`'s events; with `after`, first replay the ones after that id. """
+        sub = Subscription(username, after)
+        with self._lock:
+            self._subs.setdefault(username, set()).add(sub)
+            if after is not None:
+                for event in self._replay(username, after):
+                    sub.put(event)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.username)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.username]
+
+class DatabaseBroker(MemoryBroker):
+    """
+    Cross-worker fan-out through the events table: publish() inserts rows, and one poller
+    thread per worker (started with the first subscriber) hands new rows to local subscribers.
+    Rows older than `retention` seconds are swept at most once a minute per worker, by
+    publish() and by the pollers (so the table stays bounded with nobody subscribed).
+
+    Rows are delivered strictly in id order, because subscribers and replay resume from "after
+    id N". On PostgreSQL ids are handed out before commit, so a lower id can become visible
+    after a higher one. The poller therefore stops at a missing id and waits up to `gap_grace`
+    seconds for it to commit before skipping it (a rolled-back insert never fills its id).
+    """
+    def __init__(self, app, poll_interval=1.0, retention=86400, batch_size=500, gap_grace=5.0):
+        super().__init__(history=0)
+        self.app = app
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.batch_size = batch_size
+        self.gap_grace = gap_grace
+        self._poller = None
+        self._wake = threading.Event()
+        self._swept = 0
+        # (missing id, monotonic time it was first seen missing)
+        self._gap = None
+
+    def publish(self, events):
+        now = time.time()
+        rows = [Event(username=u, type=t, data=json.dumps(d), created_at=now) for u, t, d in events]
+        if not rows:
+            return
+        db.session.add_all(rows)
+        db.session.commit()
+        self._wake.set()
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._swept > 60:
+            self._swept = time.monotonic()
+            self.sweep()
+
+    def sweep(self):
+        """ Delete events older than the retention window; returns the number of rows removed. """
+        removed = Event.query.filter(Event.created_at < time.time() - self.retention).delete()
+        db.session.commit()
+        return removed
+
+    def last_event_id(self):
+        with self._lock:
+            if self._poller is not None and self._poller.is_alive():
+                # what has been delivered; a higher id may still have a gap below it
+                return self._last_id
+        return self._max_id()
+
+    def _max_id(self):
+        return db.session.query(func.max(Event.id)).scalar() or 0
+
+    def _replay(self, username, after):
+        # only up to what the poller has delivered; anything newer reaches the subscriber live
+        rows = (Event.query.filter(Event.username == username, Event.id > after, Event.id <= self._last_id)
+                .order_by(Event.id).limit(SUBSCRIBER_QUEUE).all())
+        return [r.to_dict() for r in rows]
+
+    def subscribe(self, username, after=None):
+        with self._lock:
+            if self._poller is None or not self._poller.is_alive():
+                # started lazily so it also exists in workers forked after create_app; the
+                # watermark starts at the current tip, older rows are only reached by replay
+                self._last_id = self._max_id()
+                self._gap = None
+                self._poller = threading.Thread(target=self._poll_loop, name="events-poller", daemon=True)
+                self._poller.start()
+        return super().subscribe(username, after)
+
+    def _poll_loop(self):
+        with self.app.app_context():
+            while True:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                try:
+                    self._poll()
+                    self._maybe_sweep()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"EVENTS_POLL_FAIL: {e}")
+                finally:
+                    db.session.remove()
+
+    def _poll(self):
+        while True:
+            rows = (Event.query.filter(Event.id > self._last_id)
+                    .order_by(Event.id).limit(self.batch_size).all())
+            with self._lock:
+                for r in rows:
+                    if r.id <= self._last_id:
+                        continue
+                    if r.id != self._last_id + 1 and not self._gap_expired():
+                        # hold back: the missing id may still commit, and must go out first
+                        return
+                    self._gap = None
+                    self._deliver(r.to_dict(), r.username)
+            if len(rows) < self.batch_size:
+                return
+
+    def _gap_expired(self):
+        missing = self._last_id + 1
+        if self._gap is None or self._gap[0] != missing:
+            self._gap = (missing, time.monotonic())
+        return time.monotonic() - self._gap[1] >= self.gap_grace
+
+def make_broker(app, backend):
+    if backend == "database":
+        return DatabaseBroker(app, poll_interval=app.config.get("EVENTS_POLL_INTERVAL", 1.0),
+                              retention=app.config.get("EVENTS_RETENTION", 86400),
+                              gap_grace=app.config.get("EVENTS_GAP_GRACE", 5.0))
+    return MemoryBroker()
+
+def publish(events):
+    """ Hand events to the configured broker; a failure is logged and never fails the request. """
+    try:
+        current_app.config["EVENTS"].publish(events)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"EVENTS_PUBLISH_FAIL: {e}")
@@ -1,9 +1,12 @@
 from db import db
 from datetime import datetime
+from sqlalchemy.orm import Session
 import json
 
 class User(db.Model):
     __tablename__ = "users"
+    # role lookups (available products, list_by_role) read usernames straight off this index
+    __table_args__ = (db.Index("ix_users_role_username", "role", "username"),)
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
@@ -15,6 +18,14 @@ class User(db.Model):
 
 class Product(db.Model):
     __tablename__ = "products"
+    # back the keyset listing: visibility filter / status first, then (sort column, id)
+    __table_args__ = (
+        db.Index("ix_products_created_at_id", "created_at", "id"),
+        db.Index("ix_products_name_id", "name", "id"),
+        db.Index("ix_products_owner_created_at_id", "owner", "created_at", "id"),
+        db.Index("ix_products_custodian_created_at_id", "custodian", "created_at", "id"),
+        db.Index("ix_products_status_created_at_id", "current_status", "created_at", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.String(120), unique=True, nullable=False)
     name = db.Column(db.String(200), nullable=False)
@@ -39,6 +50,11 @@ class Product(db.Model):
 
 class History(db.Model):
     __tablename__ = "histories"
+    # per-product timelines / deletes, and time-range exports
+    __table_args__ = (
+        db.Index("ix_histories_product_id_timestamp", "product_id", "timestamp"),
+        db.Index("ix_histories_timestamp", "timestamp"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.String(120), db.ForeignKey("products.product_id", ondelete="CASCADE"), nullable=False)
     status = db.Column(db.String(120), nullable=False)
@@ -53,14 +69,131 @@ class History(db.Model):
             "latitude": self.latitude, "longitude": self.longitude
         }
 
+# --- HANDLED-BY RELATION (distributor visibility) ---
+class ProductHandler(db.Model):
+    """ One row per (username, product) pair that appears in histories; kept in step by the flush hook below. """
+    __tablename__ = "product_handlers"
+    __table_args__ = (db.Index("ix_product_handlers_product_id", "product_id"),)
+    username = db.Column(db.String(200), primary_key=True)
+    product_id = db.Column(db.String(120), db.ForeignKey("products.product_id", ondelete="CASCADE"), primary_key=True)
+
+def insert_ignore(table, dialect_name):
+    """ INSERT that skips rows already present (on the primary key). """
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing()
+    return db.insert(table).prefix_with("IGNORE")
+
+@db.event.listens_for(Session, "after_flush")
+def _record_handlers(session, flush_context):
+    # one insert per flush (session.new still lists what was just written), on the flush's
+    # connection, so handler rows commit or roll back with their History rows
+    pairs = {(o.by_who, o.product_id) for o in session.new if isinstance(o, History)}
+    if pairs:
+        conn = session.connection()
+        conn.execute(insert_ignore(ProductHandler.__table__, conn.dialect.name),
+                     [{"username": u, "product_id": pid} for u, pid in pairs])
+
+def backfill_product_handlers(batch_size=5000):
+    """ Rebuild product_handlers from histories (idempotent); returns the number of history rows scanned. """
+    stmt = insert_ignore(ProductHandler.__table__, db.engine.dialect.name)
+    scanned = last_id = 0
+    while True:
+        rows = (db.session.query(History.id, History.by_who, History.product_id)
+                .filter(History.id > last_id).order_by(History.id).limit(batch_size).all())
+        if not rows:
+            return scanned
+        pairs = {(r.by_who, r.product_id) for r in rows}
+        db.session.execute(stmt, [{"username": u, "product_id": pid} for u, pid in pairs])
+        db.session.commit()
+        last_id = rows[-1].id
+        scanned += len(rows)
+
+# --- SALES ROLLUP (retailer sales_stats) ---
+class SalesHourly(db.Model):
+    """ Products a retailer marked Sold, per local-time hour (hour_start is the epoch of that hour's start). """
+    __tablename__ = "sales_hourly"
+    retailer = db.Column(db.String(200), primary_key=True)
+    hour_start = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+def local_hour_start(ts):
+    return int(datetime.fromtimestamp(ts).replace(minute=0, second=0, microsecond=0).timestamp())
+
+def upsert_add(table, dialect_name, keys, column):
+    """ INSERT ... or, when the key exists, add the new row's `column` to the stored one. """
+    if dialect_name in ("postgresql", "sqlite"):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        return stmt.on_conflict_do_update(index_elements=keys, set_={column: table.c[column] + stmt.excluded[column]})
+    from sqlalchemy.dialects.mysql import insert
+    stmt = insert(table)
+    return stmt.on_duplicate_key_update({column: table.c[column] + stmt.inserted[column]})
+
+def _sales_rows(histories, sign=1):
+    counts = {}
+    for h in histories:
+        key = (h.by_who, local_hour_start(h.timestamp))
+        counts[key] = counts.get(key, 0) + sign
+    return [{"retailer": r, "hour_start": hour, "count": n} for (r, hour), n in counts.items()]
+
+@db.event.listens_for(Session, "after_flush")
+def _record_sales(session, flush_context):
+    # same pattern as _record_handlers: one upsert per flush for the Sold rows just written
+    rows = _sales_rows(o for o in session.new if isinstance(o, History) and o.status == "Sold")
+    if rows:
+        conn = session.connection()
+        conn.execute(upsert_add(SalesHourly.__table__, conn.dialect.name, ["retailer", "hour_start"], "count"), rows)
+
+def forget_sales(product_ids):
+    """ Take deleted products' sales back out of the rollup; call before their History rows are deleted. """
+    sold = History.query.filter(History.product_id.in_(product_ids), History.status == "Sold").all()
+    rows = _sales_rows(sold, sign=-1)
+    if rows:
+        db.session.execute(upsert_add(SalesHourly.__table__, db.engine.dialect.name, ["retailer", "hour_start"], "count"), rows)
+
+def rebuild_sales_rollup(batch_size=5000):
+    """ Recompute sales_hourly from the Sold history rows (local time of this process); returns rows rebuilt from. """
+    SalesHourly.query.delete()
+    stmt = upsert_add(SalesHourly.__table__, db.engine.dialect.name, ["retailer", "hour_start"], "count")
+    scanned = last_id = 0
+    while True:
+        sold = (History.query.filter(History.status == "Sold", History.id > last_id)
+                .order_by(History.id).limit(batch_size).all())
+        if not sold:
+            break
+        db.session.execute(stmt, _sales_rows(sold))
+        last_id = sold[-1].id
+        scanned += len(sold)
+    db.session.commit()
+    return scanned
+
 class Block(db.Model):
     __tablename__ = "blocks"
+    # unique index: concurrent appenders in different workers cannot claim the same position
+    # (column, index) pairs: per-product / per-type / per-actor lookups come back already in chain order
+    __table_args__ = (
+        db.Index("ux_blocks_index", "index", unique=True),
+        db.Index("ix_blocks_product_index", "product_id", "index"),
+        db.Index("ix_blocks_type_index", "type", "index"),
+        db.Index("ix_blocks_actor_index", "actor", "index"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     index = db.Column(db.Integer, nullable=False)
     timestamp = db.Column(db.Float, nullable=False)
     data = db.Column(db.Text, nullable=False)
     previous_hash = db.Column(db.String(256), nullable=False)
     hash = db.Column(db.String(256), nullable=False)
+    # denormalised from data (not part of the hash); NULL type marks a row not backfilled yet
+    product_id = db.Column(db.String(120), nullable=True)
+    type = db.Column(db.String(50), nullable=True)
+    actor = db.Column(db.String(200), nullable=True)
 
     def to_dict(self):
         try: data_parsed = json.loads(self.data)
@@ -74,6 +207,12 @@ class Block(db.Model):
 # --- ORDER MODEL (Bottom-Up Requests) ---
 class Order(db.Model):
     __tablename__ = "orders"
+    # my_orders: sent / received / status filters, each read newest first as (created_at, order_id)
+    __table_args__ = (
+        db.Index("ix_orders_from_user_created_at", "from_user", "created_at", "order_id"),
+        db.Index("ix_orders_to_user_created_at", "to_user", "created_at", "order_id"),
+        db.Index("ix_orders_status_created_at", "status", "created_at", "order_id"),
+    )
 
     order_id = db.Column(db.String, primary_key=True)
     product_id = db.Column(db.String, db.ForeignKey("products.product_id"), nullable=False)
@@ -94,4 +233,21 @@ class Order(db.Model):
             "status": self.status,
             "created_at": self.created_at,
             "updated_at": self.updated_at
-        }
\ No newline at end of file
+        }
+
+# --- USER EVENTS (SSE / long-poll feed; only written by the "database" events backend) ---
+class Event(db.Model):
+    __tablename__ = "events"
+    # replay for one user after a Last-Event-ID, and the retention sweep
+    __table_args__ = (
+        db.Index("ix_events_username_id", "username", "id"),
+        db.Index("ix_events_created_at", "created_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(200), nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Float, nullable=False)
+
+    def to_dict(self):
+        return {"id": self.id, "type": self.type, "data": json.loads(self.data), "created_at": self.created_at}
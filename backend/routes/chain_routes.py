@@ -1,15 +1,68 @@
-from flask import Blueprint, current_app, jsonify
+import os
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required
+from utils.roles import role_required
+from utils.streaming import MAX_PAGE_SIZE, page_args, ledger_filters, wants_ndjson, ndjson_response, json_array_response
 bp = Blueprint("chain", __name__, url_prefix="/api/chain")
 
 @bp.route("/", methods=["GET"])
 def get_chain():
+    """
+    Whole chain, streamed: { "chain": [...], "valid": ..., "message": ... }.
+    ?after_index=<int>&limit=<int> pages through it and adds "next_after_index";
+    ?format=ndjson streams one block per line (validity in X-Chain-Valid / X-Chain-Message).
+    ?product_id=&type=&actor= keep only matching blocks (filtered in SQL, indexed).
+    """
     bc = current_app.config["BLOCKCHAIN"]
-    chain_data = [b.to_dict() for b in bc.chain]
+    try:
+        after_index, limit = page_args()
+    except ValueError:
+        return jsonify({"error": "after_index and limit must be integers"}), 400
+    filters = ledger_filters()
     valid, msg = bc.is_valid_chain()
-    return jsonify({"chain": chain_data, "valid": valid, "message": msg})
+
+    def blocks(count):
+        if filters:
+            return bc.query_blocks(after_index=after_index, limit=count, **filters)
+        start = after_index + 1
+        return bc.iter_blocks(start, start + count if count else None)
+
+    if wants_ndjson():
+        return ndjson_response((b.to_dict() for b in blocks(limit)),
+                               headers={"X-Chain-Valid": str(valid).lower(), "X-Chain-Message": msg})
+    if limit is None and "after_index" not in request.args:
+        suffix = ", " + current_app.json.dumps({"valid": valid, "message": msg})[1:]
+        return json_array_response((b.to_dict() for b in blocks(None)), prefix='{"chain": ', suffix=suffix)
+
+    # one extra block tells whether another page exists
+    limit = limit or MAX_PAGE_SIZE
+    chain_data = [b.to_dict() for b in blocks(limit + 1)]
+    next_after = chain_data[limit - 1]["index"] if len(chain_data) > limit else None
+    return jsonify({"chain": chain_data[:limit], "valid": valid, "message": msg, "next_after_index": next_after})
 
 @bp.route("/validate", methods=["GET"])
 def validate_chain():
+    """ ?full=true re-verifies every block instead of only the unverified tail. """
     bc = current_app.config["BLOCKCHAIN"]
-    valid, msg = bc.is_valid_chain()
-    return jsonify({"valid": valid, "message": msg})
\ No newline at end of file
+    full = request.args.get("full", "false").lower() in ("1", "true", "yes")
+    valid, msg = bc.is_valid_chain(full=full)
+    return jsonify({"valid": valid, "message": msg})
+
+@bp.route("/audit", methods=["GET"])
+@jwt_required()
+@role_required(["super_admin"])
+def audit_chain():
+    """
+    Full compliance audit: re-hash every block across a process pool.
+    Optional query params: ?workers=4&chunk_size=5000 (workers is capped at the CPU count)
+    """
+    bc = current_app.config["BLOCKCHAIN"]
+    try:
+        workers = int(request.args["workers"]) if request.args.get("workers") else None
+        chunk_size = int(request.args["chunk_size"]) if request.args.get("chunk_size") else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "workers and chunk_size must be integers"}), 400
+    if workers is not None:
+        # each worker is a process; never fork more than the host has cores
+        workers = min(max(1, workers), os.cpu_count() or 1)
+    return jsonify(bc.audit_chain(workers=workers, chunk_size=chunk_size)), 200
\ No newline at end of file
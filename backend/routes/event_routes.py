@@ -0,0 +1,75 @@
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt
+from db import db
+import json
+import time
+
+bp = Blueprint("events", __name__, url_prefix="/api/events")
+
+# longest wait a long-poll request may ask for
+LONG_POLL_MAX = 30
+
+def _after():
+    """ Resume point: Last-Event-ID header (sent by EventSource on reconnect) or ?after=. None means "from now". """
+    after = request.headers.get("Last-Event-ID") or request.args.get("after")
+    return int(after) if after not in (None, "") else None
+
+@bp.route("/stream", methods=["GET"])
+@jwt_required(locations=["headers", "query_string"])
+def stream_events():
+    """
+    Server-sent events for the current user: order_created, order_status_updated, custody_transfer.
+    EventSource cannot set headers, so the token may also be passed as ?jwt=<access token>.
+    The stream ends after EVENTS_STREAM_MAX_AGE seconds; EventSource reconnects with Last-Event-ID
+    and gets the events it missed.
+    """
+    try:
+        after = _after()
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID / after must be an integer"}), 400
+    broker = current_app.config["EVENTS"]
+    sub = broker.subscribe(get_jwt().get("username"), after)
+    db.session.commit()
+    heartbeat = current_app.config.get("EVENTS_HEARTBEAT", 15)
+    deadline = time.monotonic() + current_app.config.get("EVENTS_STREAM_MAX_AGE", 300)
+
+    def frames():
+        try:
+            yield "retry: 3000\n\n"
+            while not sub.closed and time.monotonic() < deadline:
+                event = sub.get(timeout=heartbeat)
+                if event is None:
+                    # comment line: keeps proxies from timing the connection out
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            broker.unsubscribe(sub)
+
+    return Response(frames(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@bp.route("/", methods=["GET"])
+@jwt_required()
+def poll_events():
+    """
+    Long-poll fallback: waits up to ?timeout= seconds (default and max 30) for events after ?after=.
+    Returns { "events": [...], "last_event_id": <pass back as ?after=> }.
+    """
+    try:
+        after = _after()
+        timeout = max(0.0, min(float(request.args.get("timeout", LONG_POLL_MAX)), LONG_POLL_MAX))
+    except ValueError:
+        return jsonify({"error": "after must be an integer and timeout a number"}), 400
+    broker = current_app.config["EVENTS"]
+    if after is None:
+        after = broker.last_event_id()
+    sub = broker.subscribe(get_jwt().get("username"), after)
+    # give the DB connection back before waiting, or parked long-polls hold the whole pool
+    db.session.commit()
+    try:
+        first = sub.get(timeout=timeout)
+        events = ([first] + sub.drain()) if first else []
+    finally:
+        broker.unsubscribe(sub)
+    return jsonify({"events": events, "last_event_id": events[-1]["id"] if events else after}), 200
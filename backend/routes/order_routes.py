@@ -4,6 +4,10 @@ from db import db
 from models import Order, Product, User
 from utils.roles import role_required
 from utils.helpers import now_ts
+from events import publish as publish_events
+from utils.pagination import keyset_page, encode_cursor
+from utils.streaming import MAX_PAGE_SIZE, ndjson_response
+from sqlalchemy import func
 import uuid
 
 bp = Blueprint("orders", __name__, url_prefix="/api/orders")
@@ -72,6 +76,7 @@ def create_order():
 
     db.session.add(order)
     db.session.commit()
+    publish_events([(final_to, "order_created", dict(order.to_dict(), product_name=product.name))])
 
     # blockchain audit
     block_info = None
@@ -94,37 +99,55 @@ def create_order():
     return jsonify({"message": "Order created", "order": order.to_dict(), "block": block_info}), 201
 
 
+ORDER_PAGE_SIZE = 50
+# my_orders rows: every order column plus the product name, from one outer join
+ORDER_COLUMNS = (*Order.__table__.columns, func.coalesce(Product.name, "Unknown Product").label("product_name"))
+
+def _orders_query(*criteria):
+    return (db.session.query(*ORDER_COLUMNS)
+            .outerjoin(Product, Product.product_id == Order.product_id).filter(*criteria))
+
 @bp.route("/my_orders", methods=["GET"])
 @jwt_required()
 def my_orders():
     """
-    Returns orders where the user is sender or receiver.
+    Returns orders where the user is sender or receiver, newest first.
     query params: ?role_filter=sent|received&status=Pending|Accepted|Rejected|Fulfilled
+    Passing ?limit= or ?cursor= (empty for the first page) returns one page; the
+    X-Next-Cursor header, passed back as ?cursor=, fetches the next one.
     """
     claims = get_jwt()
     user = claims.get("username")
     role_filter = request.args.get("role_filter")
     status = request.args.get("status")
+    extra = [Order.status == status] if status else []
 
-    q = Order.query
+    # one query per side, so each reads its own (user, created_at) index in order
     if role_filter == "sent":
-        q = q.filter_by(from_user=user)
+        queries = [_orders_query(Order.from_user == user, *extra)]
     elif role_filter == "received":
-        q = q.filter_by(to_user=user)
+        queries = [_orders_query(Order.to_user == user, *extra)]
     else:
-        q = q.filter((Order.from_user == user) | (Order.to_user == user))
+        queries = [_orders_query(Order.from_user == user, *extra), _orders_query(Order.to_user == user, *extra)]
+    cols = [Order.created_at, Order.order_id]
 
-    if status:
-        q = q.filter_by(status=status)
-
-    orders = q.order_by(Order.created_at.desc()).all()
-    order_list = []
-    for o in orders:
-        order_data = o.to_dict()
-        product = Product.query.filter_by(product_id=o.product_id).first()
-        order_data["product_name"] = product.name if product else "Unknown Product"
-        order_list.append(order_data)
-    return jsonify(order_list), 200
+    headers = {}
+    if "limit" in request.args or "cursor" in request.args:
+        try:
+            limit = max(1, min(int(request.args.get("limit", ORDER_PAGE_SIZE)), MAX_PAGE_SIZE))
+            pages = [keyset_page(q, cols, "desc", request.args.get("cursor"), limit, sort_key="orders")
+                     for q in queries]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        rows = {r.order_id: r for page, _ in pages for r in page}
+        rows = sorted(rows.values(), key=lambda r: (r.created_at, r.order_id), reverse=True)
+        if len(rows) > limit or any(more for _, more in pages):
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = encode_cursor("orders", [rows[-1].created_at, rows[-1].order_id])
+    else:
+        rows = {r.order_id: r for q in queries for r in q.all()}
+        rows = sorted(rows.values(), key=lambda r: (r.created_at, r.order_id), reverse=True)
+    return jsonify([dict(r._mapping) for r in rows]), 200, headers
 
 
 @bp.route("/<order_id>", methods=["GET"])
@@ -140,6 +163,25 @@ def get_order(order_id):
     return jsonify(order.to_dict()), 200
 
 
+ORDER_STATUSES = ("Accepted", "Rejected", "Fulfilled")
+
+def _check_order_transition(order, actor, role, new_status):
+    """ Who may change the order and to what (shared by single and batch updates). Returns (message, code) or None. """
+    # Only recipient (to_user) or super_admin can change
+    if actor != order.to_user and role != "super_admin":
+        return "only recipient can update order status", 403
+    # State transitions allowed: Pending->Accepted/Rejected, Accepted->Fulfilled
+    if not ((order.status == "Pending" and new_status in ("Accepted", "Rejected")) or
+            (order.status == "Accepted" and new_status == "Fulfilled") or
+            (order.status == "Fulfilled" and new_status == "Fulfilled")):
+        return f"invalid transition from {order.status} to {new_status}", 403
+    return None
+
+def _status_events(order, actor, note):
+    # both parties, except whoever made the change
+    return [(u, "order_status_updated", dict(order.to_dict(), updated_by=actor, note=note))
+            for u in {order.from_user, order.to_user} - {actor}]
+
 @bp.route("/<order_id>/update_status", methods=["POST"])
 @jwt_required()
 def update_order_status(order_id):
@@ -156,26 +198,20 @@ def update_order_status(order_id):
     new_status = data.get("status")
     note = data.get("note", "")
 
-    if new_status not in ("Accepted", "Rejected", "Fulfilled"):
+    if new_status not in ORDER_STATUSES:
         return jsonify({"error": "invalid status"}), 400
 
     order = Order.query.filter_by(order_id=order_id).first()
     if not order:
         return jsonify({"error": "order not found"}), 404
 
-    # Only recipient (to_user) or super_admin can change
-    if actor != order.to_user and claims.get("role") != "super_admin":
-        return jsonify({"error": "only recipient can update order status"}), 403
-
-    # State transitions allowed: Pending->Accepted/Rejected, Accepted->Fulfilled
-    if not ((order.status == "Pending" and new_status in ("Accepted", "Rejected")) or
-            (order.status == "Accepted" and new_status == "Fulfilled") or
-            (order.status == "Fulfilled" and new_status == "Fulfilled")):
-        return jsonify({"error": f"invalid transition from {order.status} to {new_status}"}), 403
+    failed = _check_order_transition(order, actor, role, new_status)
+    if failed: return jsonify({"error": failed[0]}), failed[1]
 
     order.status = new_status
     order.updated_at = now_ts()
     db.session.commit()
+    publish_events(_status_events(order, actor, note))
 
     # blockchain log
     block_info = None
@@ -212,3 +248,62 @@ def update_order_status(order_id):
         "block": block_info,
         "next_action": transfer_hint
     }), 200
+
+
+@bp.route("/update_status/batch", methods=["POST"])
+@jwt_required()
+def batch_update_order_status():
+    """
+    Accept / reject / fulfil many orders at once, with the update_status rules applied per order.
+    Body: { "orders": [ { "order_id": ..., "status": ..., "note": ... }, ... ] }
+    Orders that pass are updated in one commit; the rest are reported.
+    Streams one NDJSON line per entry (request order), then a summary line whose "transfer_prefill"
+    groups the accepted orders' products by requester, ready for POST /api/products/update/batch.
+    """
+    claims = get_jwt()
+    actor = claims.get("username")
+    role = claims.get("role")
+    items = (request.json or {}).get("orders")
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "orders (non-empty list) is required"}), 400
+    max_items = current_app.config.get("BULK_CREATE_MAX", 5000)
+    if len(items) > max_items:
+        return jsonify({"error": f"At most {max_items} orders per request"}), 413
+
+    ids = {i.get("order_id") for i in items if isinstance(i, dict) and isinstance(i.get("order_id"), str)}
+    orders = {o.order_id: o for o in Order.query.filter(Order.order_id.in_(ids)).all()} if ids else {}
+    results, updated, seen = [], [], set()
+    now = now_ts()
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        oid, new_status = item.get("order_id"), item.get("status")
+        order = orders.get(oid) if isinstance(oid, str) else None
+        failed = ("invalid status", 400) if new_status not in ORDER_STATUSES else \
+            ("order not found", 404) if order is None else \
+            ("Duplicate order_id in request", 400) if oid in seen else \
+            _check_order_transition(order, actor, role, new_status)
+        if failed:
+            results.append({"order_id": oid, "ok": False, "error": failed[0], "status_code": failed[1]})
+            continue
+        seen.add(oid)
+        order.status = new_status
+        order.updated_at = now
+        updated.append((order, item.get("note", "")))
+        results.append({"order_id": oid, "ok": True, "status": new_status})
+    if updated:
+        db.session.commit()
+        publish_events([e for order, note in updated for e in _status_events(order, actor, note)])
+
+    # accepted orders, grouped by who asked for them (the custody transfer goes back to the requester)
+    prefill = {}
+    for order, _ in updated:
+        if order.status == "Accepted":
+            prefill.setdefault(order.from_user, []).append(order.product_id)
+    summary = {"updated": len(updated), "failed": len(results) - len(updated)}
+    if prefill:
+        summary["next_action"] = "redirect_to_custodian_transfer"
+        summary["transfer_prefill"] = [{"transfer_to_username": u, "product_ids": pids} for u, pids in prefill.items()]
+    resp = ndjson_response(results + [{"summary": summary}])
+    resp.status_code = 200 if updated else 400
+    return resp
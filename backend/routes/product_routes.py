@@ -1,14 +1,21 @@
-from flask import Blueprint, request, jsonify, current_app, send_file, Response
+from flask import Blueprint, request, jsonify, current_app, Response
 from flask_jwt_extended import jwt_required, get_jwt
 from db import db
-from models import Product, History, User 
+from models import Product, History, User, ProductHandler, SalesHourly, forget_sales
 from utils.helpers import gen_product_id, now_ts
-from utils.roles import role_required
-import qrcode
-import io
+from utils.roles import role_required, usernames_for_role
+from utils.pagination import keyset_page, count_rows
+import search
+from events import publish as publish_events
+from utils.streaming import (
+    MAX_PAGE_SIZE, ledger_filters, page_args, wants_ndjson, ndjson_response, json_array_response,
+    csv_lines, ndjson_lines, download_response,
+)
+from utils.qrcodes import FORMATS as QR_FORMATS
 import base64
-import csv
-from sqlalchemy import desc, asc, or_, and_
+from datetime import datetime
+from sqlalchemy import desc, asc, or_, and_, exists
+from sqlalchemy.orm import aliased
 from flask import current_app
 # LOCAL_IP = "10.122.180.147"       # your IPv4 from ipconfig
 
@@ -54,20 +61,25 @@ def create_product():
         product_id=pid, name=name, owner=actor, custodian=actor, 
         description=data.get("description", "")
     )
-    db.session.add(product)
-
     # Capture location if provided on create
     lat, lon = data.get("latitude"), data.get("longitude")
     hist = History(product_id=pid, status="Created", by_who=actor, timestamp=now_ts(), latitude=lat, longitude=lon)
-    db.session.add(hist)
-    db.session.commit()
 
+    # product, history and ledger entry are committed together
     bc = current_app.config["BLOCKCHAIN"]
-    block = bc.add_block({
-        "type": "create_product", "product_id": pid, "action": "Product Created",
-        "owner": actor, "initial_custodian": actor,
-        "location": f"{lat},{lon}" if lat is not None else "N/A"
-    })
+    try:
+        with bc.unit_of_work() as uow:
+            db.session.add(product)
+            db.session.add(hist)
+            uow.stage({
+                "type": "create_product", "product_id": pid, "action": "Product Created",
+                "owner": actor, "initial_custodian": actor,
+                "location": f"{lat},{lon}" if lat is not None else "N/A"
+            })
+    except Exception as e:
+        current_app.logger.error(f"BLOCKCHAIN_FAILURE: {e}")
+        return jsonify({"error": "Product could not be recorded on the blockchain"}), 500
+    block = uow.blocks[0]
 
     # # Build absolute QR target to frontend public verify page
     # base_url = current_app.config.get("FRONTEND_PUBLIC_BASE_URL")
@@ -96,12 +108,7 @@ def create_product():
     # The QR code MUST point to the BACKEND /verify endpoint.
     # The backend will then redirect to the frontend.
     qr_data = f"{backend_base}/verify/{pid}"
-    
-    img = qrcode.make(qr_data)
-
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    qr_b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+    qr_b64 = base64.b64encode(current_app.config["QR_CACHE"].get(qr_data)).decode("utf-8")
 
 
     return jsonify({
@@ -111,6 +118,117 @@ def create_product():
         "public_verify_url": f"{frontend_base}/verify/{pid}?api_base_url={backend_base}"
     }), 201
 
+@bp.route("/bulk", methods=["POST"])
+@jwt_required()
+@role_required(["manufacturer"])
+def bulk_create_products():
+    """
+    Creates a lot of products in one transaction, one ledger block each, all appended in a single commit.
+    Body: { "products": [ { "name": ..., "description": ..., "latitude": ..., "longitude": ... }, ... ] }
+    Streams one NDJSON line per item (request order), then a summary line. QR codes are not drawn here;
+    each item's qr_url renders once on first request and is cached from then on.
+    """
+    actor = get_jwt().get("username")
+    items = (request.json or {}).get("products")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "'products' must be a non-empty list"}), 400
+    max_items = current_app.config.get("BULK_CREATE_MAX", 5000)
+    if len(items) > max_items:
+        return jsonify({"error": f"At most {max_items} products per request"}), 413
+
+    frontend_base = current_app.config.get("FRONTEND_PUBLIC_BASE_URL")
+    backend_base = current_app.config.get("BACKEND_PUBLIC_BASE_URL")
+    if not frontend_base or not backend_base:
+        return jsonify({"error": "Server configuration error: URLs not set"}), 500
+
+    results = []
+    bc = current_app.config["BLOCKCHAIN"]
+    try:
+        with bc.unit_of_work() as uow:
+            for i, item in enumerate(items):
+                name = item.get("name") if isinstance(item, dict) else None
+                if not name:
+                    results.append({"index": i, "ok": False, "error": "Product name is required"})
+                    continue
+                pid = gen_product_id()
+                lat, lon = item.get("latitude"), item.get("longitude")
+                db.session.add(Product(product_id=pid, name=name, owner=actor, custodian=actor,
+                                       description=item.get("description", "")))
+                db.session.add(History(product_id=pid, status="Created", by_who=actor, timestamp=now_ts(),
+                                       latitude=lat, longitude=lon))
+                uow.stage({
+                    "type": "create_product", "product_id": pid, "action": "Product Created",
+                    "owner": actor, "initial_custodian": actor,
+                    "location": f"{lat},{lon}" if lat is not None else "N/A"
+                })
+                results.append({"index": i, "ok": True, "product_id": pid})
+    except Exception as e:
+        current_app.logger.error(f"BLOCKCHAIN_FAILURE: {e}")
+        return jsonify({"error": "Products could not be recorded on the blockchain; nothing was created"}), 500
+
+    def rows():
+        blocks = iter(uow.blocks)
+        for r in results:
+            if r["ok"]:
+                pid = r["product_id"]
+                r.update({
+                    "block_index": next(blocks).index,
+                    "qr_url": f"{backend_base}/api/products/{pid}/qrcode",
+                    "history_url": f"{backend_base}/api/products/{pid}/history",
+                    "public_verify_url": f"{frontend_base}/verify/{pid}?api_base_url={backend_base}"
+                })
+            yield r
+        created = len(uow.blocks)
+        yield {"summary": {"created": created, "failed": len(results) - created}}
+    resp = ndjson_response(rows())
+    resp.status_code = 201 if uow.blocks else 400
+    return resp
+
+def _check_status_change(role, new_status, transfer_to):
+    """
+    Checks that depend only on the requested status (shared by single and batch updates).
+    Returns (new_custodian_or_None, error_response_or_None); None custodian means "the actor".
+    """
+    if new_status not in ROLE_ALLOWED.get(role, []): return None, (jsonify({"error": f"Your role '{role}' cannot set status '{new_status}'"}), 403)
+    if new_status not in NEXT_ROLE_MAP:
+        return None, None
+    if not transfer_to: return None, (jsonify({"error": f"'transfer_to_username' is required for status '{new_status}'"}), 400)
+    recipient = User.query.filter_by(username=transfer_to).first()
+    if not recipient: return None, (jsonify({"error": f"Recipient '{transfer_to}' not found"}), 404)
+    expected_role = NEXT_ROLE_MAP[new_status]
+    if recipient.role != expected_role: return None, (jsonify({"error": f"Can only transfer to '{expected_role}', but '{recipient.username}' is a '{recipient.role}'"}), 400)
+    return recipient.username, None
+
+def _check_transition(p, actor, role, new_status):
+    """ Per-product checks: custody, forward-only transition, distributor sequence. Returns (message, code) or None. """
+    if p.custodian != actor and role != "super_admin": return f"Action failed: You are not the current custodian ('{p.custodian}')", 403
+    return _check_sequence(p, role, new_status)
+
+def _check_sequence(p, role, new_status):
+    if status_index(new_status) <= status_index(p.current_status): return f"Invalid transition from '{p.current_status}' to '{new_status}'", 403
+    if role == "distributor" and new_status in DISTRIBUTOR_SEQUENCE_MAP:
+        required_previous_status = DISTRIBUTOR_SEQUENCE_MAP[new_status]
+        if p.current_status != required_previous_status:
+            return f"Invalid sequence: To set status to '{new_status}', product must first be in '{required_previous_status}' status.", 403
+    return None
+
+def _apply_status_change(uow, p, actor, new_status, new_custodian, lat, lon):
+    p.custodian = new_custodian
+    p.current_status = new_status
+    db.session.add(History(product_id=p.product_id, status=new_status, by_who=actor, latitude=lat, longitude=lon))
+    uow.stage({
+        "type": "custody_transfer" if new_status in NEXT_ROLE_MAP else "status_update", 
+        "product_id": p.product_id, "status": new_status,
+        "actor": actor, "new_custodian": new_custodian, 
+        "location": f"{lat},{lon}" if lat is not None else "N/A"
+    })
+
+def _notify_transfer(actor, new_status, new_custodian, pids):
+    """ Push one custody_transfer event to the receiving custodian (after commit). """
+    if pids and new_status in NEXT_ROLE_MAP and new_custodian != actor:
+        publish_events([(new_custodian, "custody_transfer",
+                         {"product_ids": pids, "status": new_status, "from": actor})])
+
 @bp.route("/update", methods=["POST"])
 @jwt_required()
 @role_required(["manufacturer", "distributor", "retailer"])
@@ -126,41 +244,82 @@ def explicit_custody_transfer():
 
     if p.custodian != actor and role != "super_admin": return jsonify({"error": f"Action failed: You are not the current custodian ('{p.custodian}')"}), 403
     if new_status not in ROLE_ALLOWED.get(role, []): return jsonify({"error": f"Your role '{role}' cannot set status '{new_status}'"}), 403
-    if status_index(new_status) <= status_index(p.current_status): return jsonify({"error": f"Invalid transition from '{p.current_status}' to '{new_status}'"}), 403
+    failed = _check_sequence(p, role, new_status)
+    if failed: return jsonify({"error": failed[0]}), failed[1]
 
-    if role == "distributor" and new_status in DISTRIBUTOR_SEQUENCE_MAP:
-        required_previous_status = DISTRIBUTOR_SEQUENCE_MAP[new_status]
-        if p.current_status != required_previous_status:
-            return jsonify({"error": f"Invalid sequence: To set status to '{new_status}', product must first be in '{required_previous_status}' status."}), 403
-
-    new_custodian = actor
-    if new_status in NEXT_ROLE_MAP:
-        if not transfer_to: return jsonify({"error": f"'transfer_to_username' is required for status '{new_status}'"}), 400
-        recipient = User.query.filter_by(username=transfer_to).first()
-        if not recipient: return jsonify({"error": f"Recipient '{transfer_to}' not found"}), 404
-        expected_role = NEXT_ROLE_MAP[new_status]
-        if recipient.role != expected_role: return jsonify({"error": f"Can only transfer to '{expected_role}', but '{recipient.username}' is a '{recipient.role}'"}), 400
-        new_custodian = recipient.username
+    new_custodian, error = _check_status_change(role, new_status, transfer_to)
+    if error: return error
+    new_custodian = new_custodian or actor
     
-    p.custodian = new_custodian
-    p.current_status = new_status
-    hist = History(product_id=pid, status=new_status, by_who=actor, latitude=lat, longitude=lon)
-    db.session.add(hist)
-    db.session.commit()
+    bc = current_app.config["BLOCKCHAIN"]
+    try:
+        with bc.unit_of_work() as uow:
+            _apply_status_change(uow, p, actor, new_status, new_custodian, lat, lon)
+    except Exception as e:
+        current_app.logger.error(f"BLOCKCHAIN_FAILURE: {e}")
+        return jsonify({"error": "Update could not be recorded on the blockchain; nothing was changed"}), 500
 
-    block_info = None
+    _notify_transfer(actor, new_status, new_custodian, [pid])
+    return jsonify({"message": "Update successful", "product": p.to_dict(), "block": uow.blocks[0].to_dict()}), 200
+
+@bp.route("/update/batch", methods=["POST"])
+@jwt_required()
+@role_required(["manufacturer", "distributor", "retailer"])
+def batch_custody_transfer():
+    """
+    Same status / custody change for a whole pallet, with the /update rules applied per product.
+    Body: { "product_ids": [...], "status": ..., "transfer_to_username": ..., "latitude": ..., "longitude": ... }
+    Products that pass are updated in one transaction (one block each, one commit); the rest are reported.
+    Streams one NDJSON line per product id (request order), then a summary line.
+    """
+    actor, role = get_jwt().get("username"), get_jwt().get("role")
+    data = request.json or {}
+    pids, new_status = data.get("product_ids"), data.get("status")
+    transfer_to, lat, lon = data.get("transfer_to_username"), data.get("latitude"), data.get("longitude")
+
+    if not isinstance(pids, list) or not pids or not new_status:
+        return jsonify({"error": "product_ids (non-empty list) and status are required"}), 400
+    max_items = current_app.config.get("BULK_CREATE_MAX", 5000)
+    if len(pids) > max_items:
+        return jsonify({"error": f"At most {max_items} products per request"}), 413
+
+    # status-level rules and the recipient are checked once for the whole pallet
+    new_custodian, error = _check_status_change(role, new_status, transfer_to)
+    if error: return error
+    new_custodian = new_custodian or actor
+
+    products = {p.product_id: p for p in Product.query.filter(Product.product_id.in_(set(map(str, pids)))).all()}
+    results, seen = [], set()
+    bc = current_app.config["BLOCKCHAIN"]
     try:
-        bc = current_app.config["BLOCKCHAIN"]
-        block = bc.add_block({
-            "type": "custody_transfer" if new_status in NEXT_ROLE_MAP else "status_update", 
-            "product_id": pid, "status": new_status,
-            "actor": actor, "new_custodian": new_custodian, 
-            "location": f"{lat},{lon}" if lat is not None else "N/A"
-        })
-        block_info = block.to_dict()
-    except Exception as e: print(f"BLOCKCHAIN_FAILURE: {e}")
-
-    return jsonify({"message": "Update successful", "product": p.to_dict(), "block": block_info}), 200
+        with bc.unit_of_work() as uow:
+            for pid in pids:
+                p = products.get(pid) if isinstance(pid, str) else None
+                failed = ("Product not found", 404) if p is None else \
+                    ("Duplicate product_id in request", 400) if pid in seen else \
+                    _check_transition(p, actor, role, new_status)
+                if failed:
+                    results.append({"product_id": pid, "ok": False, "error": failed[0], "status_code": failed[1]})
+                    continue
+                seen.add(pid)
+                _apply_status_change(uow, p, actor, new_status, new_custodian, lat, lon)
+                results.append({"product_id": pid, "ok": True})
+    except Exception as e:
+        current_app.logger.error(f"BLOCKCHAIN_FAILURE: {e}")
+        return jsonify({"error": "Update could not be recorded on the blockchain; nothing was changed"}), 500
+    _notify_transfer(actor, new_status, new_custodian, [r["product_id"] for r in results if r["ok"]])
+
+    def rows():
+        blocks = iter(uow.blocks)
+        for r in results:
+            if r["ok"]:
+                r.update({"status": new_status, "custodian": new_custodian, "block_index": next(blocks).index})
+            yield r
+        updated = len(uow.blocks)
+        yield {"summary": {"updated": updated, "failed": len(results) - updated}}
+    resp = ndjson_response(rows())
+    resp.status_code = 200 if uow.blocks else 400
+    return resp
 
 @bp.route("/<product_id>", methods=["GET"])
 @jwt_required(optional=True)
@@ -171,11 +330,38 @@ def get_product(product_id):
         return jsonify({"error": "not found"}), 404
     return jsonify(p.to_dict(include_history=include_history)), 200
 
+def _visible_products(query, username, role):
+    """ Role-based visibility shared by the offset and cursor listings. """
+    if role == "distributor":
+        handled = db.session.query(ProductHandler.product_id).filter(
+            ProductHandler.username == username, ProductHandler.product_id == Product.product_id)
+        return query.filter(
+            or_(
+                Product.custodian == username,
+                handled.exists()
+            )
+        )
+    elif role != "super_admin":
+        return query.filter(
+            or_(
+                Product.custodian == username,
+                Product.owner == username
+            )
+        )
+    return query
+
+# sort fields usable with ?cursor= (each backed by a (field, id) index on products)
+KEYSET_SORTS = ("created_at", "name")
+SEARCH_PAGE_SIZE = 50
+
 @bp.route("/", methods=["GET"])
 @jwt_required()
 def list_products():
-    page = int(request.args.get("page", 1))
-    per_page = int(request.args.get("per_page", 10))
+    """
+    Offset pages by default (?page=&per_page=). Passing ?cursor= (empty for the first page)
+    switches to keyset pages: no COUNT/OFFSET, "next_cursor" resumes after the last row,
+    ?total=exact|estimate adds a total.
+    """
     status = request.args.get("status")
     owner = request.args.get("owner")
     from_date = request.args.get("from")
@@ -185,29 +371,31 @@ def list_products():
     claims = get_jwt()
     username = claims.get("username")
     role = claims.get("role")
-    query = Product.query
-
-    if role == "distributor":
-        handled_ids = [h.product_id for h in History.query.filter_by(by_who=username).all()]
-        query = query.filter(
-            or_(
-                Product.custodian == username,
-                Product.product_id.in_(handled_ids)
-            )
-        )
-    elif role != "super_admin":
-        query = query.filter(
-            or_(
-                Product.custodian == username,
-                Product.owner == username
-            )
-        )
+    query = _visible_products(Product.query, username, role)
 
     if status:
         query = query.filter_by(current_status=status)
     if owner:
         query = query.filter_by(owner=owner)
     field, direction = sort.split(":") if ":" in sort else (sort, "asc")
+
+    if "cursor" in request.args:
+        if field not in KEYSET_SORTS:
+            return jsonify({"error": f"cursor pagination supports sort on {', '.join(KEYSET_SORTS)}"}), 400
+        try:
+            per_page = max(1, min(int(request.args.get("per_page", 10)), MAX_PAGE_SIZE))
+            items, next_cursor = keyset_page(query, [getattr(Product, field), Product.id], direction,
+                                             request.args["cursor"], per_page, sort_key=f"{field}:{direction}")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        total, estimated = count_rows(query, request.args.get("total"))
+        body = {"per_page": per_page, "next_cursor": next_cursor, "products": [p.to_dict() for p in items]}
+        if total is not None:
+            body.update(total=total, total_is_estimate=estimated)
+        return jsonify(body), 200
+
+    page = int(request.args.get("page", 1))
+    per_page = int(request.args.get("per_page", 10))
     if hasattr(Product, field):
         col = getattr(Product, field)
         query = query.order_by(desc(col) if direction == "desc" else asc(col))
@@ -223,16 +411,21 @@ def list_products():
 @bp.route("/search", methods=["GET"])
 @jwt_required()
 def search_products():
+    """
+    Full-text search over name and description, best matches first.
+    ?limit=<int> (default 50, max 1000); the X-Next-Cursor header, passed back as ?cursor=, fetches the next page.
+    """
     q = request.args.get("query", "")
     status = request.args.get("status")
     owner = request.args.get("owner")
-
-    query = Product.query.filter(or_(Product.name.ilike(f"%{q}%"), Product.description.ilike(f"%{q}%")))
-    if status: query = query.filter_by(current_status=status)
-    if owner: query = query.filter_by(owner=owner)
-
-    results = query.all()
-    return jsonify([p.to_dict() for p in results]), 200
+    try:
+        limit = max(1, min(int(request.args.get("limit", SEARCH_PAGE_SIZE)), MAX_PAGE_SIZE))
+        results, next_cursor = search.search_products(q, limit, cursor=request.args.get("cursor"),
+                                                      status=status, owner=owner)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return jsonify([p.to_dict() for p in results]), 200, headers
 
 @bp.route("/<product_id>", methods=["DELETE"])
 @jwt_required()
@@ -240,54 +433,148 @@ def search_products():
 def delete_product(product_id):
     product = Product.query.filter_by(product_id=product_id).first()
     if not product: return jsonify({"error": "product not found"}), 404
-    History.query.filter_by(product_id=product_id).delete()
-    db.session.delete(product)
-    db.session.commit()
-    
+
+    def purge():
+        forget_sales([product_id])
+        History.query.filter_by(product_id=product_id).delete()
+        ProductHandler.query.filter_by(product_id=product_id).delete()
+        db.session.delete(product)
+
     bc, block_info = current_app.config.get("BLOCKCHAIN"), None
     if bc:
-        block = bc.add_block({
-            "type": "delete_product", "product_id": product_id,
-            "deleted_by": get_jwt().get("username")
-        })
-        block_info = block.to_dict()
+        try:
+            with bc.unit_of_work(durable=True) as uow:
+                # these write at once: run them under the ledger lock (see Blockchain._commit_blocks)
+                uow.defer(purge)
+                uow.stage({
+                    "type": "delete_product", "product_id": product_id,
+                    "deleted_by": get_jwt().get("username")
+                })
+        except Exception as e:
+            current_app.logger.error(f"BLOCKCHAIN_FAILURE: {e}")
+            return jsonify({"error": "Delete could not be recorded on the blockchain; nothing was deleted"}), 500
+        block_info = uow.blocks[0].to_dict()
+    else:
+        purge()
+        db.session.commit()
     return jsonify({"message": "product deleted", "product_id": product_id, "block": block_info}), 200
 
+EXPORT_BATCH = 2000
+
+def _parse_time(value):
+    """ Epoch seconds or an ISO 8601 date / datetime (local time), as epoch seconds. """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def _history_export(query, columns, fmt, filename, gzip):
+    # yield_per streams rows (a server-side cursor on Postgres), so memory stays flat at any size
+    rows = query.with_entities(*columns).execution_options(yield_per=EXPORT_BATCH)
+    names = [c.key for c in columns]
+    if fmt == "ndjson":
+        lines = ndjson_lines(dict(zip(names, row)) for row in rows)
+        return download_response(lines, "application/x-ndjson", f"{filename}.ndjson", gzip)
+    return download_response(csv_lines(names, rows), "text/csv", f"{filename}.csv", gzip)
+
+def _export_args():
+    fmt = request.args.get("format", "csv").lower()
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError("format must be csv or ndjson")
+    return fmt, request.args.get("gzip", "false").lower() in ("1", "true", "yes")
+
 @bp.route("/<product_id>/export", methods=["GET"])
 @jwt_required()
 @role_required(["super_admin"])
 def export_history(product_id):
-    rows = History.query.filter_by(product_id=product_id).order_by(History.timestamp.asc()).all()
-    if not rows: return jsonify({"error": "no history found"}), 404
-    si = io.StringIO()
-    cw = csv.writer(si)
-    cw.writerow(["status", "by_who", "timestamp", "latitude", "longitude"])
-    for r in rows:
-        cw.writerow([r.status, r.by_who, r.timestamp, r.latitude, r.longitude])
-    output = si.getvalue()
-    return Response(output, mimetype="text/csv", headers={"Content-Disposition": f"attachment;filename={product_id}_history.csv"})
+    """ One product's history as a streamed download. Optional: ?format=csv|ndjson&gzip=true """
+    try:
+        fmt, gzip = _export_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    query = History.query.filter_by(product_id=product_id)
+    if not query.first(): return jsonify({"error": "no history found"}), 404
+    columns = [History.status, History.by_who, History.timestamp, History.latitude, History.longitude]
+    return _history_export(query.order_by(History.timestamp.asc(), History.id.asc()), columns, fmt,
+                           f"{product_id}_history", gzip)
+
+@bp.route("/export", methods=["GET"])
+@jwt_required()
+@role_required(["super_admin"])
+def export_histories():
+    """
+    History rows for many products, oldest first, as a streamed download.
+    Filters (optional, combinable): ?owner=<manufacturer>&from=<ts>&to=<ts> (epoch seconds or ISO date/datetime,
+    on the history timestamp). Output: ?format=csv|ndjson, ?gzip=true to compress on the fly.
+    """
+    try:
+        fmt, gzip = _export_args()
+        start = _parse_time(request.args["from"]) if request.args.get("from") else None
+        end = _parse_time(request.args["to"]) if request.args.get("to") else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    owner = request.args.get("owner")
+
+    query = History.query
+    if owner:
+        query = query.join(Product, Product.product_id == History.product_id).filter(Product.owner == owner)
+    if start is not None:
+        query = query.filter(History.timestamp >= start)
+    if end is not None:
+        query = query.filter(History.timestamp <= end)
+    columns = [History.product_id, History.status, History.by_who, History.timestamp, History.latitude, History.longitude]
+    return _history_export(query.order_by(History.timestamp.asc(), History.id.asc()), columns, fmt,
+                           f"history_{owner}" if owner else "history", gzip)
 
 @bp.route("/blockchain", methods=["GET"])
 @jwt_required()
 def get_blockchain():
+    """
+    Streams the chain as a JSON array. ?after_index=<int>&limit=<int> returns one page
+    (next cursor in the X-Next-After-Index header); ?format=ndjson streams one block per line.
+    ?product_id=&type=&actor= keep only matching blocks (filtered in SQL, indexed).
+    """
     bc = current_app.config["BLOCKCHAIN"]
-    chain = [b.to_dict() for b in bc.chain]
-    return jsonify(chain), 200
+    try:
+        after_index, limit = page_args()
+    except ValueError:
+        return jsonify({"error": "after_index and limit must be integers"}), 400
+    filters = ledger_filters()
+    headers = {}
+    if filters:
+        blocks = bc.query_blocks(after_index=after_index, limit=limit + 1 if limit else None, **filters)
+        if limit:
+            # one extra block tells whether another page exists
+            page = list(blocks)
+            if len(page) > limit:
+                headers["X-Next-After-Index"] = str(page[limit - 1].index)
+            blocks = page[:limit]
+    else:
+        start = after_index + 1
+        stop = start + limit if limit else None
+        if limit and stop <= bc.get_last_block().index:
+            headers["X-Next-After-Index"] = str(stop - 1)
+        blocks = bc.iter_blocks(start, stop)
+    blocks = (b.to_dict() for b in blocks)
+    if wants_ndjson():
+        return ndjson_response(blocks, headers=headers)
+    return json_array_response(blocks, headers=headers)
 
 @bp.route("/blockchain/<product_id>", methods=["GET"])
 @jwt_required()
 def get_product_blockchain(product_id):
     bc = current_app.config["BLOCKCHAIN"]
-    product_blocks = [b.to_dict() for b in bc.chain if b.data.get("product_id") == product_id]
+    product_blocks = [b.to_dict() for b in bc.get_product_blocks(product_id)]
     return jsonify(product_blocks), 200
 
 @bp.route("/blockchain/verify", methods=["GET"])
 @jwt_required()
 def verify_blockchain():
     bc = current_app.config["BLOCKCHAIN"]
+    full = request.args.get("full", "false").lower() in ("1", "true", "yes")
     valid, msg = (False, "Validation method not found")
     if hasattr(bc, "is_valid_chain"):
-        valid, msg = bc.is_valid_chain()
+        valid, msg = bc.is_valid_chain(full=full)
     return jsonify({"valid": valid, "message": msg}), 200
 
 @bp.route("/<product_id>/qrcode", methods=["GET"])
@@ -317,13 +604,58 @@ def get_product_qrcode(product_id):
     # The QR code MUST point to the BACKEND /verify endpoint.
     qr_data = f"{backend_base}/verify/{product_id}"
 
-    # generate PNG QR image
-    img = qrcode.make(qr_data)
-
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    # ?format=svg is much cheaper to draw than PNG; both are cached and served with a strong ETag
+    fmt = request.args.get("format", "png").lower()
+    if fmt not in QR_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(QR_FORMATS)}"}), 400
+    qr_cache = current_app.config["QR_CACHE"]
+    etag = qr_cache.key(qr_data, fmt)
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(qr_cache.get(qr_data, fmt), mimetype=QR_FORMATS[fmt])
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = current_app.config.get("QR_MAX_AGE", 86400)
+    return resp
+
+def _timeline_entry(block):
+    """ Normalize one block dict into { status, by, timestamp, latitude, longitude, raw_block_index }. """
+    data = block.get("data", {}) or {}
+
+    # normalize fields
+    status = data.get("status") or data.get("action") or data.get("type")
+    by = (
+        data.get("by")
+        or data.get("by_who")
+        or data.get("actor")
+        or data.get("username")
+        or data.get("owner")
+        or data.get("initial_custodian")
+    )
+    # prefer timestamp in data, otherwise use the block timestamp
+    timestamp = data.get("timestamp") if data.get("timestamp") is not None else block.get("timestamp")
+    latitude = data.get("latitude") if "latitude" in data else None
+    longitude = data.get("longitude") if "longitude" in data else None
+
+    # also parse location fields stored as "lat,lon"
+    loc = data.get("location")
+    if (latitude is None or longitude is None) and loc:
+        try:
+            lat_s, lon_s = str(loc).split(",")
+            latitude = float(lat_s) if lat_s not in ("", "N/A", None) else None
+            longitude = float(lon_s) if lon_s not in ("", "N/A", None) else None
+        except Exception:
+            pass
+
+    return {
+        "status": status,
+        "by": by,
+        "timestamp": timestamp,
+        "latitude": latitude,
+        "longitude": longitude,
+        "raw_block_index": block.get("index")
+    }
 
 @bp.route("/<product_id>/history", methods=["GET"])
 @jwt_required(optional=True)
@@ -332,63 +664,79 @@ def get_product_history_from_blockchain(product_id):
     Provides the product's full, verified history directly from the blockchain.
     Normalizes field names so frontend always receives:
       { status, by, timestamp, latitude, longitude, raw_block_index }
+    Responses are cached per product until a block for it is appended; repeat scans
+    sending If-None-Match get a 304.
+    """
+    bc = current_app.config["BLOCKCHAIN"]
+    cache = current_app.config["HISTORY_CACHE"]
+    # incremental: only blocks appended since the last check are verified (and evicted from the cache)
+    valid, msg = bc.is_valid_chain()
+    key = (bc.product_tip(product_id), valid, msg)
+
+    hit = cache.get(product_id, key)
+    if hit:
+        etag, body = hit
+    else:
+        generation = cache.generation
+        product = Product.query.filter_by(product_id=product_id).first()
+        if not product:
+            return jsonify({"error": "Product not found"}), 404
+        # get blocks related to this product
+        product_history_blocks = [b.to_dict() for b in bc.get_product_blocks(product_id)]
+        timeline = [_timeline_entry(block) for block in product_history_blocks]
+        body = (current_app.json.dumps({
+            "product_details": product.to_dict(include_history=False),
+            "verified_history_timeline": timeline,
+            "blockchain_verified": valid,
+            "verification_message": msg
+        }) + "\n").encode()
+        etag = cache.put(product_id, key, body, generation)
+
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    # scanners may keep a copy but must revalidate: the ledger may have moved on
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True
+    return resp
+
+@bp.route("/<product_id>/proof", methods=["GET"])
+@jwt_required(optional=True)
+def get_product_inclusion_proofs(product_id):
+    """
+    Same shape as /<product_id>/history, but every timeline entry carries its block and
+    a Merkle inclusion proof against the latest checkpoint, so a verifier only has to
+    check this product's blocks instead of the whole chain.
+    Blocks newer than the latest checkpoint come back with "proof": null and are covered
+    by the incremental chain check instead.
     """
     product = Product.query.filter_by(product_id=product_id).first()
     if not product:
         return jsonify({"error": "Product not found"}), 404
 
     bc = current_app.config["BLOCKCHAIN"]
-    # get blocks related to this product
-    product_history_blocks = [
-        b.to_dict() for b in bc.chain
-        if isinstance(b.data, dict) and b.data.get("product_id") == product_id
-    ]
-
-    timeline = []
-    for block in product_history_blocks:
-        data = block.get("data", {}) or {}
-
-        # normalize fields
-        status = data.get("status") or data.get("action") or data.get("type")
-        by = (
-    data.get("by")
-    or data.get("by_who")
-    or data.get("actor")
-    or data.get("username")
-    or data.get("owner")
-    or data.get("initial_custodian")
-)
-        # prefer timestamp in data, otherwise use the block timestamp
-        timestamp = data.get("timestamp") if data.get("timestamp") is not None else block.get("timestamp")
-        latitude = data.get("latitude") if "latitude" in data else None
-        longitude = data.get("longitude") if "longitude" in data else None
-
-        # also parse location fields stored as "lat,lon"
-        loc = data.get("location")
-        if (latitude is None or longitude is None) and loc:
-            try:
-                lat_s, lon_s = str(loc).split(",")
-                latitude = float(lat_s) if lat_s not in ("", "N/A", None) else None
-                longitude = float(lon_s) if lon_s not in ("", "N/A", None) else None
-            except Exception:
-                pass
-
-        timeline.append({
-            "status": status,
-            "by": by,
-            "timestamp": timestamp,
-            "latitude": latitude,
-            "longitude": longitude,
-            "raw_block_index": block.get("index")
-        })
-
-    valid, msg = (False, "Validation method not found")
-    if hasattr(bc, "is_valid_chain"):
+    timeline, valid = [], True
+    for b in bc.get_product_blocks(product_id):
+        block = b.to_dict()
+        proof = bc.get_inclusion_proof(b)
+        if proof is not None and not bc.verify_inclusion_proof(b, proof):
+            valid = False
+        entry = _timeline_entry(block)
+        entry.update({"block": block, "proof": proof})
+        timeline.append(entry)
+
+    msg = "Inclusion proofs verified" if valid else "Inclusion proof mismatch"
+    if valid and any(e["proof"] is None for e in timeline):
+        # blocks after the latest checkpoint: fall back to the (incremental) link check
         valid, msg = bc.is_valid_chain()
 
+    checkpoint = bc.get_latest_checkpoint()
     return jsonify({
         "product_details": product.to_dict(include_history=False),
         "verified_history_timeline": timeline,
+        "checkpoint": checkpoint.to_dict() if checkpoint else None,
         "blockchain_verified": valid,
         "verification_message": msg
     }), 200
@@ -403,34 +751,35 @@ def get_available_products():
     - Distributor → can order from manufacturers (products custodian == manufacturer)
     - Manufacturer → can see their own products
     Optional query: ?supplier_username=<username> to filter by specific user.
+    Newest first. ?limit=<int> pages the list (super_admin defaults to 100); the X-Next-Cursor
+    header, passed back as ?cursor=, fetches the next page.
     """
     claims = get_jwt()
     username = claims.get("username")
     role = claims.get("role")
 
     supplier_username = request.args.get("supplier_username")  # Optional dropdown selection
-
-    if role == "retailer":
-        distributors = [u.username for u in User.query.filter_by(role="distributor").all()]
-        manufacturers = [u.username for u in User.query.filter_by(role="manufacturer").all()]
-        if not distributors or not manufacturers:
+    try:
+        limit = int(request.args.get("limit") or 0) or None
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = request.args.get("cursor")
+
+    # owner / custodian roles are matched with semi-joins against users (indexed on role, username) instead of
+    # IN lists; as EXISTS the planner can walk products newest-first and stop at the page size
+    owner_user, custodian_user = aliased(User), aliased(User)
+    if role in ("retailer", "distributor"):
+        supplier_role = "distributor" if role == "retailer" else "manufacturer"
+        if not usernames_for_role("manufacturer") or not usernames_for_role(supplier_role):
             return jsonify([]), 200
-
-        query = Product.query.filter(
-            Product.owner.in_(manufacturers),
-            Product.custodian.in_(distributors)
-        )
-        if supplier_username:
-            query = query.filter(Product.custodian == supplier_username)
-
-    elif role == "distributor":
-        manufacturers = [u.username for u in User.query.filter_by(role="manufacturer").all()]
-        if not manufacturers:
+        if supplier_username and supplier_username not in usernames_for_role(supplier_role):
             return jsonify([]), 200
 
         query = Product.query.filter(
-            Product.owner.in_(manufacturers),
-            Product.custodian.in_(manufacturers)
+            exists().where(owner_user.username == Product.owner, owner_user.role == "manufacturer"),
+            exists().where(custodian_user.username == Product.custodian, custodian_user.role == supplier_role),
         )
         if supplier_username:
             query = query.filter(Product.custodian == supplier_username)
@@ -439,9 +788,17 @@ def get_available_products():
         query = Product.query.filter_by(owner=username, custodian=username)
 
     else:
-        query = Product.query.limit(100)
-
-    products = query.all()
+        query = Product.query
+        limit = limit or 100
+
+    if limit or cursor:
+        try:
+            products, next_cursor = keyset_page(query, [Product.created_at, Product.id], "desc", cursor,
+                                                limit or MAX_PAGE_SIZE, sort_key="available")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        products, next_cursor = query.order_by(desc(Product.created_at), desc(Product.id)).all(), None
 
     result = [{
         "product_id": p.product_id,
@@ -450,7 +807,8 @@ def get_available_products():
         "owner": p.owner,
         "custodian": p.custodian
     } for p in products]
-    return jsonify(result), 200
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return jsonify(result), 200, headers
 
 
 @bp.route("/sales_stats", methods=["GET"])
@@ -461,6 +819,7 @@ def get_sales_stats():
     - range=day   → hourly sales today
     - range=week  → daily sales for the last 7 days
     - range=month → weekly sales within this month
+    Answered from the hourly sales_hourly rollup (at most ~750 rows), bucketed by time of sale.
     """
     from collections import defaultdict
     import datetime
@@ -476,37 +835,39 @@ def get_sales_stats():
     range_type = request.args.get("range", "week").lower()
     now = datetime.datetime.now()
     today = now.date()
+    midnight = datetime.datetime.combine(today, datetime.time())
+    if range_type == "day":
+        since = midnight
+    elif range_type == "week":
+        since = midnight - datetime.timedelta(days=6)
+    else:
+        since = midnight.replace(day=1)
 
-    # fetch all sold products for this retailer
-    products = Product.query.filter_by(custodian=username, current_status="Sold").all()
-    if not products:
+    rows = (SalesHourly.query
+            .filter(SalesHourly.retailer == username, SalesHourly.hour_start >= int(since.timestamp()),
+                    SalesHourly.count > 0)
+            .all())
+    if not rows:
         return jsonify([]), 200
 
     stats = defaultdict(int)
 
-    for p in products:
-        dt = datetime.datetime.fromtimestamp(p.created_at)
+    for r in rows:
+        dt = datetime.datetime.fromtimestamp(r.hour_start)
         sale_date = dt.date()
 
         if range_type == "day":
             # Group sales for today by hour
-            if sale_date == today:
-                hour_label = dt.strftime("%H:00")
-                stats[hour_label] += 1
+            stats[dt.strftime("%H:00")] += r.count
 
         elif range_type == "week":
             # Group sales for last 7 days by day
-            if sale_date >= today - datetime.timedelta(days=6):
-                day_label = sale_date.strftime("%a")  # Mon, Tue, etc.
-                stats[day_label] += 1
+            stats[sale_date.strftime("%a")] += r.count  # Mon, Tue, etc.
 
         elif range_type == "month":
             # Group this month's sales into 4 weeks
-            if sale_date.month == today.month and sale_date.year == today.year:
-                day_of_month = sale_date.day
-                week_num = math.ceil(day_of_month / 7)
-                week_label = f"Week {week_num}"
-                stats[week_label] += 1
+            week_num = math.ceil(sale_date.day / 7)
+            stats[f"Week {week_num}"] += r.count
 
     # Convert to sorted list
     # For day: sort hours; for week: sort days Mon→Sun; for month: sort weeks 1→4
@@ -1,7 +1,6 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required
-from models import User
-from utils.roles import role_required
+from utils.roles import role_required, usernames_for_role
 
 bp = Blueprint("users", __name__, url_prefix="/api/users")
 
@@ -22,9 +21,9 @@ def list_users_by_role():
     if role not in valid_roles:
         return jsonify({"error": f"Invalid role. Choose from {valid_roles}"}), 400
 
-    users = User.query.filter(User.role == role).all()
-    if not users:
+    usernames = usernames_for_role(role)
+    if not usernames:
         return jsonify([]), 200
 
-    result = [{"username": u.username, "role": u.role} for u in users]
+    result = [{"username": u, "role": role} for u in sorted(usernames)]
     return jsonify(result), 200
\ No newline at end of file
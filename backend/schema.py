@@ -0,0 +1,27 @@
+from db import db
+from sqlalchemy import inspect, text
+
+def upgrade_schema(app):
+    """
+    db.create_all() only creates missing tables, so columns and indexes added to models
+    later never reach an existing database. Add any declared column or index that is missing.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            try:
+                col_type = column.type.compile(dialect=db.engine.dialect)
+                prep = db.engine.dialect.identifier_preparer
+                with db.engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {prep.format_table(table)} "
+                                      f"ADD COLUMN {prep.format_column(column)} {col_type}"))
+            except Exception as e:
+                app.logger.error(f"SCHEMA_UPGRADE_FAIL: {table.name}.{column.name}: {e}")
+        for index in table.indexes:
+            try:
+                index.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                app.logger.error(f"SCHEMA_UPGRADE_FAIL: {index.name}: {e}")
@@ -0,0 +1,100 @@
+import re
+from sqlalchemy import Column, Integer, MetaData, Table, Text, and_, func, literal_column, or_, text
+from db import db
+from models import Product
+from utils.pagination import encode_cursor, decode_cursor
+
+# SQLite: FTS5 table keyed on products.id, kept in step by triggers (so every insert path is covered).
+# Postgres: a generated tsvector column with a GIN index. Anything else falls back to ILIKE.
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE products_fts USING fts5(
+        name, description, tokenize = 'unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, coalesce(new.description, ''));
+    END""",
+    """CREATE TRIGGER products_fts_ad AFTER DELETE ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+        UPDATE products_fts SET name = new.name, description = coalesce(new.description, '') WHERE rowid = new.id;
+    END""",
+    "INSERT INTO products_fts(rowid, name, description) SELECT id, name, coalesce(description, '') FROM products",
+]
+POSTGRES_DDL = [
+    """ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B')) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING gin (search_vector)",
+]
+
+# kept out of db.metadata so create_all() never tries to build it as a plain table
+products_fts = Table("products_fts", MetaData(), Column("rowid", Integer), Column("products_fts", Text))
+
+# bm25 column weights: a name hit counts 10x a description hit
+BM25 = func.bm25(literal_column("products_fts"), 10.0, 1.0)
+SEARCH_VECTOR = literal_column("products.search_vector")
+
+def ensure_search_index(app):
+    """ Create the full-text index for the configured database if it is missing (first run backfills it). """
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as conn:
+            if dialect == "sqlite":
+                exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")).first()
+                if not exists:
+                    for stmt in SQLITE_DDL:
+                        conn.execute(text(stmt))
+            elif dialect == "postgresql":
+                for stmt in POSTGRES_DDL:
+                    conn.execute(text(stmt))
+    except Exception as e:
+        app.logger.error(f"SEARCH_INDEX_FAIL: {e}")
+
+def _terms(q):
+    return re.findall(r"\w+", q or "")
+
+def search_products(q, limit, cursor=None, status=None, owner=None):
+    """
+    Ranked product search: every word must match, the last one as a prefix.
+    Returns (products, next_cursor); the cursor is (score, id) of the last row.
+    """
+    terms = _terms(q)
+    dialect = db.engine.dialect.name
+    query = db.session.query(Product)
+    if status: query = query.filter(Product.current_status == status)
+    if owner: query = query.filter(Product.owner == owner)
+
+    if not terms:
+        # nothing to rank on: newest first, like the listing
+        score, better = literal_column("0"), None
+    elif dialect == "sqlite":
+        match = " ".join(f'"{t}"' for t in terms[:-1]) + f' "{terms[-1]}"*'
+        query = query.join(products_fts, products_fts.c.rowid == Product.id).filter(products_fts.c.products_fts.match(match))
+        score, better = BM25, "lower"
+    elif dialect == "postgresql":
+        tsq = func.to_tsquery("simple", " & ".join(terms[:-1] + [terms[-1] + ":*"]))
+        query = query.filter(SEARCH_VECTOR.op("@@")(tsq))
+        score, better = func.ts_rank_cd(SEARCH_VECTOR, tsq), "higher"
+    else:
+        for t in terms:
+            query = query.filter(or_(Product.name.ilike(f"%{t}%"), Product.description.ilike(f"%{t}%")))
+        score, better = literal_column("0"), None
+
+    sort_key = f"search:{better or 'id'}"
+    if cursor:
+        last_score, last_id = decode_cursor(cursor, sort_key)
+        if better is None:
+            query = query.filter(Product.id < last_id)
+        else:
+            past = score > last_score if better == "lower" else score < last_score
+            query = query.filter(or_(past, and_(score == last_score, Product.id > last_id)))
+    if better is None:
+        order = [Product.id.desc()]
+    else:
+        order = [score.asc() if better == "lower" else score.desc(), Product.id.asc()]
+    rows = query.add_columns(score.label("score")).order_by(*order).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort_key, [rows[-1].score, rows[-1][0].id])
+    return [r[0] for r in rows], next_cursor
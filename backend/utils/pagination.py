@@ -0,0 +1,57 @@
+import base64
+import json
+from sqlalchemy import asc, desc, func, select, text, tuple_
+from db import db
+
+# ?total=estimate counts at most this many rows on databases without planner estimates
+ESTIMATE_CAP = 10000
+
+def encode_cursor(sort_key, values):
+    """ Opaque cursor: the sort key it belongs to plus the last row's (sort value, id). """
+    raw = json.dumps([sort_key, *values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor, sort_key):
+    """ Inverse of encode_cursor; raises ValueError if it is junk or was issued for another sort. """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, *values = json.loads(raw)
+    except Exception:
+        raise ValueError("invalid cursor")
+    if key != sort_key:
+        raise ValueError("cursor does not match sort")
+    return values
+
+def keyset_page(query, cols, direction, cursor, limit, sort_key):
+    """
+    One page of `query` ordered by `cols` (sort column(s), unique id last), resuming after `cursor`.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    order = desc if direction == "desc" else asc
+    if cursor:
+        after = decode_cursor(cursor, sort_key)
+        key = tuple_(*cols)
+        query = query.filter(key < tuple_(*after) if direction == "desc" else key > tuple_(*after))
+    rows = query.order_by(*[order(c) for c in cols]).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(sort_key, [getattr(last, c.key) for c in cols])
+
+def count_rows(query, mode):
+    """
+    ?total= for cursor pages: "exact" runs COUNT(*), "estimate" asks the Postgres planner
+    (elsewhere counts up to ESTIMATE_CAP rows). Returns (total, is_estimate); (None, False) when not asked.
+    """
+    if mode == "exact":
+        return query.order_by(None).count(), False
+    if mode != "estimate":
+        return None, False
+    if db.engine.dialect.name == "postgresql":
+        stmt = query.order_by(None).statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+        plan = db.session.execute(text(f"EXPLAIN (FORMAT JSON) {stmt}")).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"]), True
+    capped = query.order_by(None).limit(ESTIMATE_CAP).subquery()
+    total = db.session.execute(select(func.count()).select_from(capped)).scalar()
+    return total, total >= ESTIMATE_CAP
@@ -0,0 +1,43 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class PasswordHasherBusy(Exception):
+    """ More hash jobs are running and queued than the pool allows; the caller should answer 503. """
+
+class PasswordHasher:
+    """
+    Runs the password KDF on a small dedicated pool instead of the request thread, so a login burst
+    keeps at most `workers` cores busy hashing. Jobs beyond `workers + queue_depth` are refused
+    (PasswordHasherBusy) rather than piling up. hashlib's scrypt / pbkdf2 release the GIL, so
+    threads are enough to keep the rest of the worker responsive.
+    """
+    def __init__(self, method="scrypt:32768:8:1", workers=2, queue_depth=32):
+        self.method = method
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._prefix = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """ True if the hash was made with other KDF parameters than the configured ones. """
+        if self._prefix is None:
+            # werkzeug expands shorthands ("scrypt" -> "scrypt:32768:8:1"); compare what it writes
+            self._prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        return password_hash.split("$", 1)[0] != self._prefix
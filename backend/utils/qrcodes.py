@@ -0,0 +1,100 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import qrcode
+
+# bump when rendering options change so stale files on disk are not served
+RENDER_VERSION = f"1:{getattr(qrcode, '__version__', '')}"
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+def _svg(matrix):
+    """ One <path> of horizontal runs of dark modules, one unit per module (no Pillow, no per-module nodes). """
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                runs.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+            else:
+                x += 1
+    size = len(matrix)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(runs)}"/></svg>').encode()
+
+def render(data, fmt="png"):
+    """ Draw the QR code for `data`; SVG is written straight from the module matrix. """
+    qr = qrcode.QRCode()
+    qr.add_data(data)
+    qr.make(fit=True)
+    if fmt == "svg":
+        return _svg(qr.get_matrix())
+    buf = io.BytesIO()
+    qr.make_image().save(buf, format="PNG")
+    return buf.getvalue()
+
+class QRCache:
+    """
+    QR images keyed on (format, encoded data): an in-memory LRU in front of an on-disk store
+    shared by every worker. The key doubles as a strong ETag since rendering is deterministic.
+    """
+    def __init__(self, cache_dir=None, max_items=1024):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data, fmt="png"):
+        return hashlib.sha256(f"{RENDER_VERSION}:{fmt}:{data}".encode()).hexdigest()
+
+    def _path(self, key, fmt):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+
+    def get(self, data, fmt="png"):
+        """ Image bytes for `data`, rendered at most once per process and once per cache_dir. """
+        key = self.key(data, fmt)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        body = self._read(key, fmt)
+        if body is None:
+            body = render(data, fmt)
+            self._write(key, fmt, body)
+        with self._lock:
+            self._items[key] = body
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return body
+
+    def _read(self, key, fmt):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key, fmt), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, key, fmt, body):
+        if not self.cache_dir:
+            return
+        path = self._path(key, fmt)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, so a concurrent reader never sees half a file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except OSError:
+            # the disk store is only an optimisation; the caller still gets the image
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
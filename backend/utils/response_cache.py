@@ -0,0 +1,58 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+class ResponseCache:
+    """
+    Serialised responses per entity id: an in-memory LRU of (key, etag, body).
+    An entry is only served while the caller's key still matches, and evict() drops it at once.
+    """
+    def __init__(self, max_items=10000):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every evict(); a put() that started before one is dropped, so a response
+        # built from rows read just before a write cannot outlive the eviction
+        self.generation = 0
+
+    def get(self, item_id, key):
+        """ (etag, body) cached for `item_id` under `key`, or None. """
+        with self._lock:
+            entry = self._items.get(item_id)
+            if entry is None or entry[0] != key:
+                return None
+            self._items.move_to_end(item_id)
+            return entry[1], entry[2]
+
+    def put(self, item_id, key, body, generation):
+        """ Store `body` (bytes) and return its ETag; `generation` is self.generation read before building it. """
+        etag = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            if generation == self.generation and self.max_items > 0:
+                self._items[item_id] = (key, etag, body)
+                self._items.move_to_end(item_id)
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+        return etag
+
+    def evict(self, *item_ids):
+        with self._lock:
+            self.generation += 1
+            for item_id in item_ids:
+                self._items.pop(item_id, None)
+
+# product ids are read straight from the canonical payload bytes, so blocks that other workers
+# appended (pulled in by refresh) are not decoded just to evict; a nested match only over-evicts
+_PRODUCT_ID = re.compile(rb'"product_id": ("(?:[^"\\]|\\.)*")')
+
+def evict_block_products(cache):
+    """ Blockchain append listener: drop cached responses for every product a new block touches. """
+    def listener(block_obj):
+        pids = [json.loads(m) for m in _PRODUCT_ID.findall(block_obj.payload)]
+        if b'"cascade_deleted_products"' in block_obj.payload and isinstance(block_obj.data, dict):
+            pids.extend(block_obj.data.get("cascade_deleted_products") or [])
+        if pids:
+            cache.evict(*pids)
+    return listener
@@ -1,6 +1,8 @@
-from flask import jsonify
+from flask import jsonify, current_app
 from flask_jwt_extended import get_jwt
 from functools import wraps
+import threading
+import time
 
 def role_required(allowed_roles):
     """
@@ -16,4 +18,25 @@ def role_required(allowed_roles):
                 return jsonify({"error": "Access denied. Role not allowed"}), 403
             return fn(*args, **kwargs)
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
+
+# role -> (expires_at, usernames); per worker, cleared here on register/delete and by TTL elsewhere
+_role_users = {}
+_role_users_lock = threading.Lock()
+
+def usernames_for_role(role):
+    """ Usernames holding `role`, cached for ROLE_CACHE_TTL seconds. """
+    now = time.monotonic()
+    with _role_users_lock:
+        hit = _role_users.get(role)
+        if hit and hit[0] > now:
+            return hit[1]
+    from models import User
+    names = frozenset(u for (u,) in User.query.with_entities(User.username).filter(User.role == role))
+    with _role_users_lock:
+        _role_users[role] = (now + current_app.config.get("ROLE_CACHE_TTL", 30), names)
+    return names
+
+def invalidate_role_cache():
+    with _role_users_lock:
+        _role_users.clear()
@@ -0,0 +1,96 @@
+from flask import Response, current_app, request, stream_with_context
+import csv
+import io
+import zlib
+
+MAX_PAGE_SIZE = 1000
+
+def page_args(default_limit=None):
+    """
+    Cursor pagination args shared by the chain endpoints: ?after_index=<int>&limit=<int>.
+    Returns (after_index, limit); raises ValueError on junk input.
+    """
+    after_index = int(request.args.get("after_index", -1))
+    limit = request.args.get("limit")
+    limit = int(limit) if limit else default_limit
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return after_index, limit
+
+LEDGER_FILTERS = ("product_id", "type", "actor")
+
+def ledger_filters():
+    """ ?product_id=&type=&actor= filters, pushed down to the indexed blocks columns. """
+    return {k: request.args[k] for k in LEDGER_FILTERS if request.args.get(k)}
+
+def wants_ndjson():
+    return request.args.get("format", "").lower() == "ndjson" or \
+        "application/x-ndjson" in request.headers.get("Accept", "")
+
+def ndjson_response(rows, headers=None):
+    """ One JSON document per line, written out as the generator produces them. """
+    dumps = current_app.json.dumps
+
+    def generate():
+        for row in rows:
+            yield dumps(row) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson", headers=headers)
+
+def json_array_response(rows, prefix="", suffix="", headers=None):
+    """
+    Stream `prefix [row, row, ...] suffix` without building the list first.
+    prefix/suffix let callers wrap the array in an object, e.g. '{"chain": ' and ', "valid": true}'.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield prefix + "["
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + dumps(row)
+        yield "]" + suffix
+    return Response(stream_with_context(generate()), mimetype="application/json", headers=headers)
+
+def csv_lines(header, rows):
+    """ CSV text one line at a time, so only the current row is ever held. """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        yield buf.getvalue()
+
+def ndjson_lines(rows):
+    dumps = current_app.json.dumps
+    for row in rows:
+        yield dumps(row) + "\n"
+
+def _coalesce(chunks, size=64 * 1024):
+    # hand the server ~64 KB writes instead of one tiny write per row
+    parts, pending = [], 0
+    for chunk in chunks:
+        parts.append(chunk)
+        pending += len(chunk)
+        if pending >= size:
+            yield b"".join(parts)
+            parts, pending = [], 0
+    if parts:
+        yield b"".join(parts)
+
+def _gzip(chunks, level=6):
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+def download_response(lines, mimetype, filename, gzip=False):
+    """ Stream text lines as a file download, optionally gzip-compressed on the fly (adds .gz). """
+    chunks = _coalesce(line.encode() for line in lines)
+    if gzip:
+        chunks, mimetype, filename = _gzip(chunks), "application/gzip", filename + ".gz"
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment;filename={filename}"})